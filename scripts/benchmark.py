@@ -0,0 +1,261 @@
+import argparse
+import json
+import multiprocessing
+import os
+import pickle
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.classifier_copy import TFNaiveBayesClassifier as Classifier
+
+BENCHMARK_VERSION = 2
+
+
+def make_corpus(n_docs, vocab_size=50000, mean_length=120, spam_ratio=0.4, seed=0):
+    """
+    Deterministic synthetic corpus: Zipfian word frequencies, with spam drawing 3% of its mass from a
+    shuffled copy of the distribution so the two classes overlap but remain separable.
+    """
+    rng = np.random.default_rng(seed)
+    words = np.array([f'w{i}' for i in range(vocab_size)], dtype=object)
+    ham_p = 1.0 / np.arange(1, vocab_size + 1) ** 1.1
+    ham_p /= ham_p.sum()
+    spam_p = 0.97 * ham_p + 0.03 * ham_p[rng.permutation(vocab_size)]
+    cdfs = {'ham': np.cumsum(ham_p), 'spam': np.cumsum(spam_p)}
+
+    labels = np.where(rng.random(n_docs) < spam_ratio, 'spam', 'ham')
+    lengths = rng.poisson(mean_length, n_docs) + 1
+    emails = [None] * n_docs
+    for label, cdf in cdfs.items():
+        rows = np.flatnonzero(labels == label)
+        # One vectorized draw for every token of the class, then cut into documents
+        token_ids = np.minimum(np.searchsorted(cdf, rng.random(lengths[rows].sum())), vocab_size - 1)
+        ends = np.cumsum(lengths[rows])
+        for row, start, end in zip(rows, ends - lengths[rows], ends):
+            emails[row] = ' '.join(words[token_ids[start:end]])
+    return emails, labels.tolist()
+
+
+def load_corpus(path):
+    """Load a bundled JSONL corpus with one {"text": ..., "label": "spam"|"ham"} object per line"""
+    emails, labels = [], []
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            record = json.loads(line)
+            emails.append(record['text'])
+            labels.append(record['label'])
+    return emails, labels
+
+
+def peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 2 ** 10
+    except ImportError:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 2 ** 20
+
+
+class TFNaiveBayesContender:
+    name = 'tf_naive_bayes'
+
+    def __init__(self, compact=None, **options):
+        self.model = Classifier(**options)
+        self.compact_options = compact
+
+    def fit(self, emails, labels):
+        self.model.fit(emails, labels)
+        if self.compact_options:
+            self.model.compact(**self.compact_options)
+
+    def classify_one(self, email):
+        return self.model.classify(email)
+
+    def predict(self, emails):
+        return self.model.predict_batch(emails)
+
+    def save(self, path):
+        self.model.save_model(path)
+
+    def load(self, path):
+        self.model = Classifier.load_model(path)
+
+
+class SklearnMultinomialNBContender:
+    name = 'sklearn_multinomial_nb'
+
+    def __init__(self):
+        from sklearn.feature_extraction.text import CountVectorizer
+        from sklearn.naive_bayes import MultinomialNB
+        self.vectorizer = CountVectorizer()
+        self.model = MultinomialNB()
+
+    def fit(self, emails, labels):
+        self.model.fit(self.vectorizer.fit_transform(emails), labels)
+
+    def classify_one(self, email):
+        return self.model.predict(self.vectorizer.transform([email]))[0]
+
+    def predict(self, emails):
+        return self.model.predict(self.vectorizer.transform(emails)).tolist()
+
+    def save(self, path):
+        with open(path, 'wb') as file:
+            pickle.dump((self.vectorizer, self.model), file)
+
+    def load(self, path):
+        with open(path, 'rb') as file:
+            self.vectorizer, self.model = pickle.load(file)
+
+
+CONTENDERS = {
+    TFNaiveBayesContender.name: TFNaiveBayesContender,
+    SklearnMultinomialNBContender.name: SklearnMultinomialNBContender,
+}
+
+
+def get_corpus(config):
+    if config['corpus']:
+        return load_corpus(config['corpus'])
+    return make_corpus(config['docs'], config['vocab_size'], config['mean_length'], seed=config['seed'])
+
+
+def run_contender(name, config, options=None):
+    """Benchmark one contender. Runs in a fresh process so peak RSS is not shared with other runs."""
+    emails, labels = get_corpus(config)
+    split = int(len(emails) * (1 - config['test_fraction']))
+    train_emails, train_labels = emails[:split], labels[:split]
+    test_emails, test_labels = emails[split:], labels[split:]
+    corpus_rss_mb = peak_rss_mb()
+
+    contender = CONTENDERS[name](**(options or {}))
+    start = time.perf_counter()
+    contender.fit(train_emails, train_labels)
+    fit_seconds = time.perf_counter() - start
+
+    latencies = []
+    for email in test_emails[:config['latency_samples']]:
+        start = time.perf_counter()
+        contender.classify_one(email)
+        latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    predictions = contender.predict(test_emails)
+    batch_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        model_path = os.path.join(directory, 'model')
+        contender.save(model_path)
+        model_bytes = os.path.getsize(model_path)
+        start = time.perf_counter()
+        contender.load(model_path)
+        load_seconds = time.perf_counter() - start
+        # Score once more with the loaded model, which may read its tables from a memory map
+        start = time.perf_counter()
+        contender.predict(test_emails)
+        loaded_batch_seconds = time.perf_counter() - start
+
+    return {
+        'fit_seconds': fit_seconds,
+        'fit_docs_per_second': len(train_emails) / fit_seconds,
+        'latency_p50_ms': float(np.percentile(latencies, 50) * 1000) if latencies else None,
+        'latency_p99_ms': float(np.percentile(latencies, 99) * 1000) if latencies else None,
+        'batch_docs_per_second': len(test_emails) / batch_seconds if batch_seconds else None,
+        'accuracy': float(np.mean(np.array(predictions) == np.array(test_labels))),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_over_corpus_mb': peak_rss_mb() - corpus_rss_mb,
+        'model_bytes': model_bytes,
+        'load_seconds': load_seconds,
+        'loaded_batch_docs_per_second': len(test_emails) / loaded_batch_seconds if loaded_batch_seconds else None,
+        'train_docs': len(train_emails),
+        'test_docs': len(test_emails),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of TFNaiveBayesClassifier against CountVectorizer + MultinomialNB")
+    parser.add_argument('--docs', type=int, default=10000, help="synthetic corpus size (10k-10M)")
+    parser.add_argument('--vocab-size', type=int, default=50000)
+    parser.add_argument('--mean-length', type=int, default=120, help="mean words per synthetic email")
+    parser.add_argument('--corpus', help="JSONL corpus with text/label fields, used instead of the synthetic one")
+    parser.add_argument('--test-fraction', type=float, default=0.2)
+    parser.add_argument('--latency-samples', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--contenders', nargs='+', choices=sorted(CONTENDERS), default=sorted(CONTENDERS))
+    parser.add_argument('--hashed-bits', type=int, nargs='*', default=[],
+                        help="also run tf_naive_bayes in hashing mode with 2^k buckets for each k, e.g. 14 16 18 20")
+    parser.add_argument('--tfidf', action='store_true', help="also run tf_naive_bayes with weighting='tfidf' and 'tfidf_norm'")
+    parser.add_argument('--compact-top-k', type=int, nargs='*', default=[],
+                        help="also run tf_naive_bayes compacted to its top k words (by mutual information) for each k")
+    parser.add_argument('--compact-dtype', choices=['float16', 'int8'], nargs='*', default=[],
+                        help="also run tf_naive_bayes with its scoring tables quantized to each dtype")
+    parser.add_argument('--log-ratio-cache-sizes', type=int, nargs='*', default=[],
+                        help="also run tf_naive_bayes with a log-ratio cache of each size, for single-email latency")
+    parser.add_argument('--output', help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    config = {
+        'docs': args.docs,
+        'vocab_size': args.vocab_size,
+        'mean_length': args.mean_length,
+        'corpus': args.corpus,
+        'test_fraction': args.test_fraction,
+        'latency_samples': args.latency_samples,
+        'seed': args.seed,
+    }
+    # (result key, contender, constructor options)
+    runs = [(name, name, None) for name in args.contenders]
+    runs += [(f'{TFNaiveBayesContender.name}_hashed_2^{bits}', TFNaiveBayesContender.name, {'n_features': 2 ** bits})
+             for bits in args.hashed_bits]
+    if args.tfidf:
+        runs += [(f'{TFNaiveBayesContender.name}_{weighting}', TFNaiveBayesContender.name, {'weighting': weighting})
+                 for weighting in ('tfidf', 'tfidf_norm')]
+    runs += [(f'{TFNaiveBayesContender.name}_top_{k}', TFNaiveBayesContender.name, {'compact': {'top_k': k}})
+             for k in args.compact_top_k]
+    runs += [(f'{TFNaiveBayesContender.name}_{dtype}', TFNaiveBayesContender.name, {'compact': {'table_dtype': dtype}})
+             for dtype in args.compact_dtype]
+    runs += [(f'{TFNaiveBayesContender.name}_cache_{size}', TFNaiveBayesContender.name, {'log_ratio_cache_size': size})
+             for size in args.log_ratio_cache_sizes]
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for key, name, options in runs:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            try:
+                results[key] = executor.submit(run_contender, name, config, options).result()
+            except ImportError as error:
+                results[key] = {'skipped': str(error)}
+        if options:
+            results[key]['options'] = options
+        print(f"{key}: done", file=sys.stderr)
+
+    report = {
+        'benchmark_version': BENCHMARK_VERSION,
+        'config': config,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
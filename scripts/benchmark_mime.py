@@ -0,0 +1,88 @@
+import argparse
+import email
+import os
+import random
+import sys
+import tempfile
+import time
+from email import policy
+from email.message import EmailMessage
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.mime_extract import extract_mbox, html_to_text, iter_mbox
+
+WORDS = ['free', 'offer', 'meeting', 'project', 'win', 'money', 'report', 'click', 'lunch', 'the', 'a', 'to',
+         'Straße', 'naïve', 'prize', 'tomorrow', 'urgent', 'team', 'deal', 'notes']
+
+
+def make_message(rng, words_per_email):
+    """One of the shapes seen in real mail: plain only, plain + HTML alternative with an attachment, or HTML only"""
+    text = ' '.join(rng.choice(WORDS) for _ in range(words_per_email))
+    message = EmailMessage()
+    message['Subject'] = ' '.join(rng.choice(WORDS) for _ in range(5))
+    message['From'] = 'sender@example.com'
+    shape = rng.randrange(3)
+    if shape == 0:
+        message.set_content(text, cte='quoted-printable')
+    elif shape == 1:
+        message.set_content(text, cte='quoted-printable')
+        message.add_alternative(f'<html><body><p>{text}</p></body></html>', subtype='html', cte='base64')
+        message.add_attachment(rng.randbytes(2048), maintype='application', subtype='octet-stream', filename='report.bin')
+    else:
+        message.set_content(f'<html><head><style>p {{color: red}}</style></head><body><div><b>{text}</b></div></body></html>',
+                            subtype='html', cte='base64')
+    return message
+
+
+def write_mbox(path, n_emails, words_per_email, seed=0):
+    rng = random.Random(seed)
+    with open(path, 'wb') as file:
+        for _ in range(n_emails):
+            file.write(b'From sender@example.com Thu Jan  1 00:00:00 2026\n')
+            file.write(make_message(rng, words_per_email).as_bytes(policy=policy.SMTP.clone(linesep='\n')))
+            file.write(b'\n')
+
+
+def stdlib_extract(raw):
+    """Baseline: the email package's parser, preferring plain text and stripping HTML the same way"""
+    message = email.message_from_bytes(raw, policy=policy.default)
+    body = message.get_body(preferencelist=('plain', 'html'))
+    if body is None:
+        return ''
+    content = body.get_content()
+    return html_to_text(content) if body.get_content_type() == 'text/html' else content
+
+
+def megabytes_per_second(extract, path):
+    size = os.path.getsize(path)
+    start = time.perf_counter()
+    n_empty = sum(not text.strip() for text in extract(path))
+    return size / 2 ** 20 / (time.perf_counter() - start), n_empty
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark MIME text extraction throughput over a synthetic mbox")
+    parser.add_argument('--emails', type=int, default=5000)
+    parser.add_argument('--words-per-email', type=int, default=200)
+    parser.add_argument('--jobs', type=int, nargs='*', default=[2, 4], help="process pool sizes to run besides a single process")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'benchmark.mbox')
+        write_mbox(path, args.emails, args.words_per_email)
+        print(f"{args.emails} emails, {os.path.getsize(path) / 2 ** 20:.1f} MB")
+        extractors = {
+            'email package (policy.default)': lambda path: map(stdlib_extract, iter_mbox(path)),
+            'mime_extract': lambda path: (message['content'] for message in extract_mbox(path)),
+        }
+        for n_jobs in args.jobs:
+            extractors[f'mime_extract, {n_jobs} processes'] = lambda path, n_jobs=n_jobs: (
+                message['content'] for message in extract_mbox(path, n_jobs))
+        for name, extract in extractors.items():
+            throughput, n_empty = megabytes_per_second(extract, path)
+            print(f"{name:40s} {throughput:>10.1f} MB/sec  ({n_empty} empty)")
+
+
+if __name__ == "__main__":
+    main()
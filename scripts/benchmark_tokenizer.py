@@ -0,0 +1,76 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.classifier_copy import TFNaiveBayesClassifier as Classifier
+from src.tokenizer import Tokenizer
+
+WORDS = ['free', 'offer', 'meeting', 'Project', 'WIN', 'money', 'report', 'click', 'lunch', 'the', 'a', 'to',
+         'Straße', 'naïve', 'prize', 'tomorrow', 'urgent', 'team', 'deal', 'notes']
+PUNCTUATION = ['', '', '', '!', '.', ',', '?', '"', ')', ':']
+
+
+def make_emails(n_emails, words_per_email, seed=0):
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) + rng.choice(PUNCTUATION) for _ in range(words_per_email)) for _ in range(n_emails)]
+
+
+def legacy_tokenize(email_content):
+    """The tokenization fit() used before the Tokenizer existed, kept as a baseline"""
+    words = email_content.split()
+    words = [word.lower() for word in words]
+    words = [word.strip('.,!?;:"()[]}{') for word in words]
+    return words
+
+
+def tokens_per_second(tokenize, emails):
+    start = time.perf_counter()
+    n_tokens = sum(len(tokenize(email)) for email in emails)
+    return n_tokens / (time.perf_counter() - start)
+
+
+def check_parity(emails):
+    """
+    Train on the emails and check that classification tokenizes them exactly like training did:
+    no training token may be unseen at inference, and the scalar and batch paths must agree.
+    """
+    labels = ['spam' if i % 2 else 'ham' for i in range(len(emails))]
+    classifier = Classifier()
+    classifier.fit(emails, labels)
+    _, unseen_counts = classifier._count_matrix(emails)
+    if unseen_counts.any():
+        return False
+    batch = classifier.predict_proba_batch(emails)
+    for email, (spam_probability, _) in zip(emails, batch):
+        if abs(classifier.classification_probability(email)['spam_probability'] - spam_probability) > 1e-9:
+            return False
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tokenizer throughput and check train/inference parity")
+    parser.add_argument('--emails', type=int, default=20000)
+    parser.add_argument('--words-per-email', type=int, default=200)
+    args = parser.parse_args()
+
+    emails = make_emails(args.emails, args.words_per_email)
+    tokenizers = {
+        'legacy fit() tokenization': legacy_tokenize,
+        'Tokenizer()': Tokenizer(),
+        'Tokenizer(stop_words, min_length=2)': Tokenizer(stop_words={'the', 'a', 'to'}, min_length=2),
+        'Tokenizer(ngram_range=(1, 2))': Tokenizer(ngram_range=(1, 2)),
+    }
+    for name, tokenize in tokenizers.items():
+        print(f"{name:40s} {tokens_per_second(tokenize, emails):>14,.0f} tokens/sec")
+
+    parity = check_parity(emails[:2000])
+    print(f"Train/inference tokenization parity: {'OK' if parity else 'FAILED'}")
+    return 0 if parity else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
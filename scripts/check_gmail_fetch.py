@@ -0,0 +1,164 @@
+import argparse
+import base64
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from googleapiclient.errors import HttpError
+
+from src.gmail_api import iter_email_details, stream_spam_and_ham
+from src.metrics import Metrics, set_metrics
+
+
+class _Response(dict):
+    """The parts of an httplib2 response HttpError reads"""
+
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
+        self.reason = 'Too Many Requests' if status == 429 else 'Error'
+
+
+class _Request:
+    def __init__(self, run):
+        self.run = run
+
+    def execute(self):
+        return self.run()
+
+
+class FakeGmail:
+    """
+    In-memory stand-in for the Gmail service object: messages().list() pages at most `page_size` ids at a
+    time, messages().get() fails once with 429 for every id in `rate_limited`, and each batch request
+    takes `latency` seconds, like one HTTP round trip.
+    """
+
+    def __init__(self, n_spam, n_ham, page_size=37, rate_limited=(), latency=0.0):
+        self.labels = {f'spam{i}': 'SPAM' for i in range(n_spam)}
+        self.labels.update({f'ham{i}': 'CATEGORY_PERSONAL' for i in range(n_ham)})
+        self.page_size = page_size
+        self.rate_limited = set(rate_limited)
+        self.latency = latency
+        self.list_calls = 0
+        self.batch_calls = 0
+        self.get_calls = {}
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return self
+
+    def list(self, userId, q='', maxResults=100, pageToken=None):
+        def run():
+            self.list_calls += 1
+            spam = q == 'label:SPAM'
+            ids = [msg_id for msg_id, label in self.labels.items() if (label == 'SPAM') == spam]
+            start = int(pageToken or 0)
+            page = ids[start:start + min(maxResults, self.page_size)]
+            result = {'messages': [{'id': msg_id} for msg_id in page]}
+            if start + len(page) < len(ids):
+                result['nextPageToken'] = str(start + len(page))
+            return result
+        return _Request(run)
+
+    def get(self, userId, id, format):
+        def run():
+            self.get_calls[id] = self.get_calls.get(id, 0) + 1
+            if id in self.rate_limited:
+                self.rate_limited.discard(id)
+                raise HttpError(_Response(429), b'Rate limit exceeded')
+            data = base64.urlsafe_b64encode(f'body of {id}'.encode('utf-8')).decode('ascii')
+            return {'id': id, 'labelIds': [self.labels[id]],
+                    'payload': {'headers': [{'name': 'Subject', 'value': id}], 'body': {'data': data}}}
+        return _Request(run)
+
+    def new_batch_http_request(self, callback):
+        service = self
+
+        class Batch:
+            def __init__(self):
+                self.requests = []
+
+            def add(self, request, request_id):
+                self.requests.append((request, request_id))
+
+            def execute(self):
+                service.batch_calls += 1
+                time.sleep(service.latency)
+                for request, request_id in self.requests:
+                    try:
+                        callback(request_id, request.execute(), None)
+                    except HttpError as error:
+                        callback(request_id, None, error)
+        return Batch()
+
+
+def check_pagination(n_spam, n_ham, page_size):
+    """Every message of both categories arrives exactly once, across several list pages"""
+    service = FakeGmail(n_spam, n_ham, page_size)
+    fetched = [(label, msg_id) for label, msg_id, _ in stream_spam_and_ham(service)]
+    expected = [('spam', f'spam{i}') for i in range(n_spam)] + [('ham', f'ham{i}') for i in range(n_ham)]
+    pages = -(-n_spam // page_size) + -(-n_ham // page_size)
+
+    capped = FakeGmail(n_spam, n_ham, page_size)
+    limit = min(n_spam, n_ham) - 1
+    n_capped = sum(1 for _ in stream_spam_and_ham(capped, max_results_per_category=limit))
+    return fetched == expected and service.list_calls == pages and n_capped == 2 * limit
+
+
+def check_batch_retry(n_messages, batch_size):
+    """Messages rate-limited inside a batch are fetched again, once, and still yielded"""
+    msg_ids = [f'spam{i}' for i in range(n_messages)]
+    rate_limited = msg_ids[::7]
+    service = FakeGmail(n_messages, 0, rate_limited=rate_limited)
+    metrics = Metrics()
+    previous = set_metrics(metrics)
+    try:
+        fetched = [msg_id for msg_id, _ in iter_email_details(service, msg_ids, batch_size=batch_size, backoff=0.0)]
+    finally:
+        set_metrics(previous)
+    retried = sorted(msg_id for msg_id, calls in service.get_calls.items() if calls == 2)
+    counters = metrics.counters
+    return (sorted(fetched) == sorted(msg_ids) and retried == sorted(rate_limited)
+            and max(service.get_calls.values()) == 2
+            and counters.get('gmail_message_retries') == len(rate_limited)
+            and counters.get('gmail_messages_fetched') == n_messages and 'gmail_message_errors' not in counters)
+
+
+def check_stats(n_spam, n_ham, batch_size, latency):
+    """The stats dict counts every message and reports a throughput matching the batch round trips"""
+    service = FakeGmail(n_spam, n_ham, latency=latency)
+    stats = {}
+    start = time.perf_counter()
+    n_fetched = sum(1 for _ in stream_spam_and_ham(service, batch_size=batch_size, stats=stats))
+    elapsed = time.perf_counter() - start
+    print(f"{stats['messages']} messages in {service.batch_calls} batches of {batch_size} with {latency * 1000:.0f} ms "
+          f"round trips: {stats['messages_per_second']:,.1f} messages/sec")
+    return (stats['messages'] == n_fetched == n_spam + n_ham and 0 < stats['seconds'] <= elapsed
+            and abs(stats['messages_per_second'] - stats['messages'] / stats['seconds']) < 1e-6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check Gmail fetching against an in-memory fake Gmail service")
+    parser.add_argument('--spam', type=int, default=120)
+    parser.add_argument('--ham', type=int, default=80)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.02, help="seconds each simulated batch request takes")
+    args = parser.parse_args()
+
+    checks = {
+        'Pagination': check_pagination(args.spam, args.ham, page_size=37),
+        '429 retry inside a batch': check_batch_retry(args.spam, args.batch_size),
+        'messages/sec stats': check_stats(args.spam, args.ham, args.batch_size, args.latency),
+    }
+    for name, passed in checks.items():
+        print(f"{name}: {'OK' if passed else 'FAILED'}")
+    return 0 if all(checks.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
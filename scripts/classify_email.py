@@ -0,0 +1,318 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import time
+from itertools import islice
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.classifier_copy import TFNaiveBayesClassifier as Classifier
+from src.metrics import enable_metrics, get_metrics
+from src.mime_extract import extract_mbox
+from src.model_registry import ModelRegistry
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, 'trained_models')
+MODEL_PATTERNS = ('*.nbm', '*.pkl')
+MAX_BODY_BYTES = 16 * 2 ** 20
+
+
+def find_latest_model(models_dir=MODELS_DIR):
+    """Return the model the directory's CURRENT pointer names, else its most recently written model file, or None"""
+    current = ModelRegistry(models_dir).current_path()
+    if current is not None:
+        return current
+    paths = [path for pattern in MODEL_PATTERNS for path in glob.glob(os.path.join(models_dir, pattern))]
+    return max(paths, key=os.path.getmtime, default=None)
+
+
+def resolve_model_path(model_path=None, models_dir=MODELS_DIR):
+    """The model file to load: `model_path` if given, else the latest model in the directory"""
+    model_path = model_path or find_latest_model(models_dir)
+    if model_path is None:
+        raise FileNotFoundError(f"No trained model found in {models_dir}. Run scripts/train.py first.")
+    return model_path
+
+
+def to_result(classes, probabilities):
+    """The most probable class plus a '<class>_probability' entry per class (spam_probability and ham_probability by default)"""
+    probabilities = [float(probability) for probability in probabilities]
+    result = {'label': classes[probabilities.index(max(probabilities))]}
+    result.update((f'{label}_probability', probability) for label, probability in zip(classes, probabilities))
+    return result
+
+
+class ModelHolder:
+    """
+    Holds the current model and swaps in the version the models directory's CURRENT file points to (or,
+    without one, its newest model file). Batches grab the reference once when they start, so a reload
+    never affects requests already being scored.
+    """
+
+    def __init__(self, model_path=None, models_dir=MODELS_DIR):
+        self.models_dir = models_dir
+        # An explicitly chosen model file is only reloaded when that file itself is rewritten
+        self.pinned = model_path is not None
+        self.model_path = resolve_model_path(model_path, models_dir)
+        self.model = self.load(self.model_path)
+        self.loaded_mtime = os.path.getmtime(self.model_path)
+
+    @staticmethod
+    def load(path):
+        """
+        Load a model and score a warm-up email, so a broken file fails here, in the reload thread,
+        instead of on the first request after the swap
+        """
+        model = Classifier.load_model(path)
+        model.predict_proba_batch(['warm up'])
+        return model
+
+    async def reload_if_changed(self):
+        """Load the current model file in a worker thread and swap it in if it differs from the one being served"""
+        latest = self.model_path if self.pinned else (find_latest_model(self.models_dir) or self.model_path)
+        mtime = os.path.getmtime(latest)
+        if latest == self.model_path and mtime == self.loaded_mtime:
+            return False
+        model = await asyncio.get_running_loop().run_in_executor(None, self.load, latest)
+        self.model, self.model_path, self.loaded_mtime = model, latest, mtime
+        print(f"Loaded model {latest}", file=sys.stderr)
+        return True
+
+    async def watch(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reload_if_changed()
+            except Exception as error:
+                # Keep serving the current model if the new file is incomplete or corrupt
+                print(f"Model reload failed: {error}", file=sys.stderr)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent classification requests into batches of up to `max_batch_size` emails,
+    waiting at most `max_wait` seconds after the first request of a batch before scoring it.
+    """
+
+    def __init__(self, holder, max_batch_size=64, max_wait=0.005):
+        self.holder = holder
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = asyncio.Queue()
+        self.batches = 0
+        self.emails = 0
+
+    async def classify(self, email_content):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((email_content, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            model = self.holder.model
+            try:
+                # Score off the event loop so new requests keep queueing meanwhile
+                probabilities = await loop.run_in_executor(None, model.predict_proba_batch, [text for text, _ in batch])
+            except Exception as error:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(error)
+                continue
+            for (_, future), row in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(to_result(model.classes, row))
+            self.batches += 1
+            self.emails += len(batch)
+
+
+class ClassificationServer:
+    """
+    Minimal HTTP/1.1 server:
+      POST /classify  {"email": "..."} or {"emails": ["...", ...]}
+      GET  /health    current model and batching counters
+      POST /explain   {"email": "...", "top_n": 10, "confidence": 0.999} verdict plus the tokens that drove it
+      POST /reload    check the models directory for a newer model now
+      GET  /metrics   timers and counters in Prometheus text format (with --metrics)
+    """
+
+    def __init__(self, holder, batcher):
+        self.holder = holder
+        self.batcher = batcher
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while (line := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                if length > MAX_BODY_BYTES:
+                    await self.respond(writer, 413, {'error': 'request body too large'})
+                    break
+                body = await reader.readexactly(length) if length else b''
+                try:
+                    status, payload = await self.route(method, path, body)
+                except Exception as error:
+                    # Answer instead of dropping the connection; the client may still have requests queued on it
+                    print(f"Error handling {method} {path}: {error!r}", file=sys.stderr)
+                    status, payload = 500, {'error': 'internal server error'}
+                await self.respond(writer, status, payload)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        if method == 'POST' and path == '/classify':
+            try:
+                request = json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                return 400, {'error': 'body must be JSON'}
+            if not isinstance(request, dict):
+                return 400, {'error': "expected {'email': str} or {'emails': [str, ...]}"}
+            if isinstance(request.get('email'), str):
+                return 200, await self.batcher.classify(request['email'])
+            if isinstance(request.get('emails'), list) and all(isinstance(text, str) for text in request['emails']):
+                return 200, {'results': list(await asyncio.gather(*map(self.batcher.classify, request['emails'])))}
+            return 400, {'error': "expected {'email': str} or {'emails': [str, ...]}"}
+        if method == 'POST' and path == '/explain':
+            try:
+                request = json.loads(body or b'{}')
+            except json.JSONDecodeError:
+                return 400, {'error': 'body must be JSON'}
+            if not isinstance(request, dict) or not isinstance(request.get('email'), str):
+                return 400, {'error': "expected {'email': str, 'top_n': int, 'confidence': float}"}
+            return await self.explain(request['email'], request.get('top_n', 10), request.get('confidence'))
+        if method == 'GET' and path == '/health':
+            return 200, {'model': self.holder.model_path, 'batches': self.batcher.batches, 'emails': self.batcher.emails}
+        if method == 'GET' and path == '/metrics' and get_metrics().enabled:
+            return 200, get_metrics().to_prometheus()
+        if method == 'POST' and path == '/reload':
+            return 200, {'reloaded': await self.holder.reload_if_changed(), 'model': self.holder.model_path}
+        return 404, {'error': 'not found'}
+
+    async def explain(self, email_content, top_n, confidence):
+        """Score one email on the scalar path, which can stop early and report its top contributing tokens"""
+        if not isinstance(top_n, int) or top_n < 1 or (confidence is not None and not isinstance(confidence, (int, float))):
+            return 400, {'error': "top_n must be a positive integer and confidence a number"}
+        model = self.holder.model
+        try:
+            probabilities = await asyncio.get_running_loop().run_in_executor(
+                None, lambda: model.classification_probability(email_content, confidence, top_n))
+        except ValueError as error:
+            return 400, {'error': str(error)}
+        result = to_result(model.classes, [probabilities[f'{label}_probability'] for label in model.classes])
+        result['top_tokens'] = [{'token': token, 'contribution': contribution} for token, contribution in probabilities['top_tokens']]
+        for key in ('tokens_scored', 'tokens_total', 'early_exit'):
+            if key in probabilities:
+                result[key] = probabilities[key]
+        return 200, result
+
+    @staticmethod
+    async def respond(writer, status, payload):
+        # String payloads are sent as plain text (the Prometheus exposition format), everything else as JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode('utf-8'), 'text/plain; version=0.0.4'
+        else:
+            body, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+        reason = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 413: 'Payload Too Large', 500: 'Internal Server Error'}[status]
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+
+async def serve(args):
+    holder = ModelHolder(args.model, args.models_dir)
+    batcher = MicroBatcher(holder, args.max_batch_size, args.max_wait_ms / 1000)
+    server = ClassificationServer(holder, batcher)
+    if args.unix_socket:
+        listener = await asyncio.start_unix_server(server.handle, path=args.unix_socket)
+        where = args.unix_socket
+    else:
+        listener = await asyncio.start_server(server.handle, args.host, args.port)
+        where = f'http://{args.host}:{args.port}'
+    print(f"Serving {holder.model_path} on {where}", file=sys.stderr)
+    tasks = [asyncio.create_task(batcher.run())]
+    if args.reload_interval > 0:
+        tasks.append(asyncio.create_task(holder.watch(args.reload_interval)))
+    async with listener:
+        await listener.serve_forever()
+
+
+def iter_input_emails(path, n_jobs=1):
+    """
+    Stream email texts from a JSONL file (strings or objects with 'text'/'content') or an mbox file,
+    whose MIME bodies are extracted in `n_jobs` processes
+    """
+    if path.endswith('.jsonl') or path == '-':
+        file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+        with file:
+            for line in file:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record if isinstance(record, str) else record.get('text', record.get('content', ''))
+    else:
+        for message in extract_mbox(path, n_jobs):
+            yield message['content']
+
+
+def classify_file(args):
+    """Classify an mbox/JSONL file as a stream, writing one JSON result per line to stdout"""
+    model = Classifier.load_model(resolve_model_path(args.model, args.models_dir))
+    emails = iter_input_emails(args.input, args.jobs)
+    count = 0
+    start = time.perf_counter()
+    while batch := list(islice(emails, args.max_batch_size)):
+        for row in model.predict_proba_batch(batch):
+            sys.stdout.write(json.dumps(to_result(model.classes, row)) + '\n')
+        count += len(batch)
+    elapsed = time.perf_counter() - start
+    print(f"Classified {count} emails in {elapsed:.2f}s", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify emails with a trained model, as a server or over a file")
+    parser.add_argument('input', nargs='?', help="mbox or .jsonl file to classify ('-' for JSONL on stdin); omit to run the server")
+    parser.add_argument('--model', help="model file (default: newest file in --models-dir)")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix-socket', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--max-batch-size', type=int, default=64)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help="longest a request waits for its batch to fill")
+    parser.add_argument('--reload-interval', type=float, default=10.0, help="seconds between checks for a newer model (0 disables)")
+    parser.add_argument('--metrics', action='store_true', help="collect timers and counters, served at GET /metrics")
+    parser.add_argument('--jobs', type=int, default=1, help="processes extracting mbox messages (-1 for every CPU)")
+    args = parser.parse_args()
+    if args.metrics:
+        enable_metrics()
+
+    if args.input:
+        classify_file(args)
+    else:
+        asyncio.run(serve(args))
+
+
+if __name__ == "__main__":
+    main()
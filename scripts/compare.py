@@ -3,29 +3,27 @@ import sys
 #make sure to include src module in the path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.classifier_copy import TFNaiveBayesClassifier as Classifier
-from src.gmail_api import fetch_spam_and_ham
+from src.email_store import EmailStore
+from src.gmail_api import authenticate_gmail
 from sklearn.naive_bayes import MultinomialNB
 from sklearn.model_selection import train_test_split
 from sklearn.feature_extraction.text import CountVectorizer
 
 def get_emails():
-    if os.path.exists('token.json'):
-        os.remove('token.json')
-        spam_mails, ham_mails = fetch_spam_and_ham(100)
-    else:
-        spam_mails, ham_mails = fetch_spam_and_ham(100)
-    
-    spam_mails = {msg_id: metadata for msg_id, metadata in spam_mails.items() if metadata['content'] != ''}
-    ham_mails = {msg_id: metadata for msg_id, metadata in ham_mails.items() if metadata['content'] != ''}
-    
+    with EmailStore() as store:
+        service = authenticate_gmail()
+        if service:
+            store.sync(service, 100)
+        spam_mails = {msg_id: metadata for msg_id, _, metadata in store.iter_messages('spam') if metadata['content'] != ''}
+        ham_mails = {msg_id: metadata for msg_id, _, metadata in store.iter_messages('ham') if metadata['content'] != ''}
+
     return spam_mails, ham_mails
 
 # Fetch emails
 spam_mails, ham_mails = get_emails()
 
-X_naive_train, X_naive_test, y_naive_train, y_naive_test = train_test_split(spam_mails.update(ham_mails),['spam'] * len(spam_mails) + ['ham'] * len(ham_mails), test_size=0.2, random_state=42)
-
-X = list(spam_mails.values()) + list(ham_mails.values())
+# For a reproducible offline comparison (throughput, latency, memory) see scripts/benchmark.py
+X = [metadata['content'] for metadata in spam_mails.values()] + [metadata['content'] for metadata in ham_mails.values()]
 y = ['spam'] * len(spam_mails) + ['ham'] * len(ham_mails)
 X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
@@ -1,44 +1,200 @@
-import pickle
+import argparse
+import hashlib
 import os
 import sys
-import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.classifier_copy import TFNaiveBayesClassifier as Classifier
-from src.gmail_api import fetch_spam_and_ham
+from src.email_store import DEFAULT_STORE_PATH, EmailStore
+from src.gmail_api import CATEGORY_QUERIES, authenticate_gmail
+from src.metrics import enable_metrics
+from src.mime_extract import extract_mbox
+from src.model_registry import ModelRegistry
 
-def get_emails():
-    if os.path.exists('token.json'):
-        os.remove('token.json')
-        spam_mails, ham_mails = fetch_spam_and_ham(100)
-    else:
-        spam_mails, ham_mails = fetch_spam_and_ham(100)
-    
-    spam_mails = {msg_id: metadata for msg_id, metadata in spam_mails.items() if metadata['content'] != ''}
-    ham_mails = {msg_id: metadata for msg_id, metadata in ham_mails.items() if metadata['content'] != ''}
-    
-    return spam_mails, ham_mails
-
-def train_NB_classifier():
-    spam_mails, ham_mails = get_emails()
-    classifier = Classifier()
-    print("Training Naive Bayes classifier")
-    # Prepare emails and labels for the fit method
-    emails = list(spam_mails.values()) + list(ham_mails.values())
-    labels = [1] * len(spam_mails) + [0] * len(ham_mails)
-    classifier.fit(emails=emails, labels=labels)
-    
-    date = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-
-    if not os.path.exists('trained_models'):
-        os.makedirs('trained_models')
-    os.chdir('trained_models')
-    with open(f'TF_NaiveBayes_Classifier_{date}.pkl',mode='wb') as file:
-        pickle.dump(classifier,file)
-
-    print(f"Training completed and model saved as 'TF_NaiveBayes_Classifier_{date}.pkl'.")
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODELS_DIR = os.path.join(BASE_DIR, 'trained_models')
+
+def sync_emails(store, max_results_per_category=100, service=None):
+    """Fetch only new or changed messages into the local email store"""
+    service = service or authenticate_gmail()
+    if not service:
+        print("Could not connect to Gmail, training on the emails already in the local store")
+        return
+    stats = store.sync(service, max_results_per_category)
+    print(f"Synced email store: {stats['stored']} messages stored, {stats['deleted']} removed, {len(store)} in total.")
+
+def import_mbox(store, path, label, n_jobs=1):
+    """
+    Add the messages of an mbox file to the store under `label` for offline training. Messages are keyed
+    by Message-ID (or a hash of their text), so importing the same file again adds nothing.
+    """
+    if label not in CATEGORY_QUERIES:
+        raise ValueError(f"Unknown label {label!r}, expected one of {tuple(CATEGORY_QUERIES)}")
+    imported = 0
+    for details in extract_mbox(path, n_jobs):
+        key = details['message_id'] or hashlib.sha1('\n'.join((details['subject'], details['date'], details['content'])).encode('utf-8')).hexdigest()
+        msg_id = f'mbox:{key}'
+        if msg_id not in store:
+            store.put(msg_id, label, details, commit=False)
+            imported += 1
+    store.connection.commit()
+    return imported
+
+def train_NB_classifier(max_results_per_category=100, offline=False, models_dir=MODELS_DIR):
+    with EmailStore() as store:
+        if not offline:
+            sync_emails(store, max_results_per_category)
+        # One class per Gmail category the store is synced from
+        classifier = Classifier(classes=tuple(CATEGORY_QUERIES))
+        print("Training Naive Bayes classifier")
+        watermark, removed = store.max_rowid(), store.removed_count()
+        # Stream straight from the store, reusing cached tokens from earlier runs
+        classifier.partial_fit(store.iter_training_pairs(classifier.tokenizer))
+
+    model_path = ModelRegistry(models_dir).publish(classifier, {'watermark': watermark, 'removed_messages': removed, 'holdout_percent': 0})
+    print(f"Training completed and model saved as '{os.path.basename(model_path)}'.")
     return classifier
 
+def holdout_accuracy(classifier, store, holdout_percent):
+    """Accuracy on the held-out side of the store's train/holdout split, or None if it is empty"""
+    emails, labels = [], []
+    for email_content, label in store.iter_training_pairs(holdout_percent=holdout_percent, holdout=True):
+        emails.append(email_content)
+        labels.append(label)
+    if not emails:
+        return None
+    predictions = classifier.predict_batch(emails)
+    return sum(prediction == label for prediction, label in zip(predictions, labels)) / len(labels)
+
+def retrain(store_path, models_dir, holdout_percent=10, max_accuracy_drop=0.01):
+    """
+    One retraining cycle, run in a worker process by the daemon. Continues from the current model when
+    the store has only gained messages since it was trained, retrains from scratch otherwise, and
+    publishes the candidate only if its holdout accuracy is within max_accuracy_drop of the current
+    model's. Returns a report of what happened.
+    """
+    registry = ModelRegistry(models_dir)
+    current_path = registry.current_path()
+    current = Classifier.load_model(current_path) if current_path else None
+    info = registry.metadata(current_path) if current_path else {}
+    classes = tuple(CATEGORY_QUERIES)
+
+    with EmailStore(store_path) as store:
+        watermark, removed = store.max_rowid(), store.removed_count()
+        incremental = (current is not None and current.classes == classes and current.email_counts_known and info.get('watermark') is not None
+                       and info.get('removed_messages') == removed and info.get('holdout_percent') == holdout_percent)
+        if incremental:
+            if watermark == info['watermark']:
+                return {'published': False, 'reason': 'no new messages'}
+            # A second mapping of the same file; partial_fit() copies its counts before training further
+            candidate = Classifier.load_model(current_path)
+            after_rowid = info['watermark']
+        else:
+            candidate = Classifier(classes=classes)
+            after_rowid = 0
+        candidate.partial_fit(store.iter_training_pairs(candidate.tokenizer, after_rowid=after_rowid, holdout_percent=holdout_percent))
+        if not candidate.email_count.any():
+            return {'published': False, 'reason': 'no training messages'}
+
+        report = {
+            'incremental': incremental,
+            'accuracy': holdout_accuracy(candidate, store, holdout_percent),
+            'baseline_accuracy': holdout_accuracy(current, store, holdout_percent) if current is not None else None,
+        }
+    if None not in (report['accuracy'], report['baseline_accuracy']) and report['accuracy'] < report['baseline_accuracy'] - max_accuracy_drop:
+        return dict(report, published=False, reason='holdout accuracy dropped')
+
+    metadata = dict(report, watermark=watermark, removed_messages=removed, holdout_percent=holdout_percent,
+                    trained_emails=int(candidate.document_count))
+    return dict(report, published=True, model=registry.publish(candidate, metadata))
+
+def run_daemon(interval, max_results_per_category=100, offline=False, models_dir=MODELS_DIR, store_path=DEFAULT_STORE_PATH,
+               holdout_percent=10, max_accuracy_drop=0.01, keep_versions=5, max_age_days=None):
+    """
+    Sync, retrain and publish every `interval` seconds until interrupted. Training runs in a separate
+    process so its memory is returned to the system after every cycle; servers watching the models
+    directory pick up each published model on their next reload check.
+    """
+    registry = ModelRegistry(models_dir)
+    service = None if offline else authenticate_gmail()
+    while True:
+        started = time.monotonic()
+        if service:
+            with EmailStore(store_path) as store:
+                try:
+                    sync_emails(store, max_results_per_category, service)
+                except Exception as error:
+                    print(f"Sync failed, retraining on the local store: {error}")
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            try:
+                report = executor.submit(retrain, store_path, models_dir, holdout_percent, max_accuracy_drop).result()
+            except Exception as error:
+                report = {'published': False, 'reason': f'retraining failed: {error}'}
+        if report['published']:
+            print(f"Published {os.path.basename(report['model'])} (holdout accuracy {report['accuracy']}, was {report['baseline_accuracy']})")
+        else:
+            print(f"Kept the current model: {report['reason']}")
+        for path in registry.prune(keep_versions, max_age_days):
+            print(f"Removed old model {os.path.basename(path)}")
+        time.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+def run_profiled(func, *args, top=25):
+    """Run func under cProfile and tracemalloc and print where the time and memory went"""
+    import cProfile
+    import pstats
+    import tracemalloc
+
+    tracemalloc.start()
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"\n=== cProfile: top {top} functions by cumulative time ===", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats('cumulative').print_stats(top)
+        print(f"=== tracemalloc: {current / 2 ** 20:.1f} MB still allocated, {peak / 2 ** 20:.1f} MB peak; top {top} lines ===", file=sys.stderr)
+        for stat in snapshot.statistics('lineno')[:top]:
+            print(stat, file=sys.stderr)
+
 if __name__ == "__main__":
-    train_NB_classifier()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Sync the local email store and train the Naive Bayes classifier")
+    parser.add_argument('--max-results', type=int, default=100, help="messages per category to list on a full sync")
+    parser.add_argument('--offline', action='store_true', help="train on the local email store without syncing")
+    parser.add_argument('--models-dir', default=MODELS_DIR)
+    parser.add_argument('--profile', action='store_true', help="print cProfile, tracemalloc and timer summaries to stderr")
+    parser.add_argument('--metrics', help="write timers and counters to this file (Prometheus text if it ends in .prom, else JSON)")
+    parser.add_argument('--import-mbox', nargs=2, action='append', default=[], metavar=('LABEL', 'PATH'),
+                        help="add the messages of an mbox file to the local store under LABEL first (repeatable)")
+    parser.add_argument('--jobs', type=int, default=1, help="processes extracting imported mbox messages (-1 for every CPU)")
+    parser.add_argument('--daemon', action='store_true', help="keep syncing, retraining and publishing validated models")
+    parser.add_argument('--interval', type=float, default=3600, help="seconds between daemon retraining cycles")
+    parser.add_argument('--holdout-percent', type=int, default=10, help="share of messages the daemon holds out for validation")
+    parser.add_argument('--max-accuracy-drop', type=float, default=0.01,
+                        help="largest holdout accuracy drop versus the current model the daemon still publishes")
+    parser.add_argument('--keep-versions', type=int, default=5, help="newest model versions the daemon keeps")
+    parser.add_argument('--max-age-days', type=float, help="also delete versions older than this (the current one is always kept)")
+    args = parser.parse_args()
+    models_dir = os.path.abspath(args.models_dir)
+
+    metrics = enable_metrics() if args.profile or args.metrics else None
+
+    for label, path in args.import_mbox:
+        with EmailStore() as store:
+            print(f"Imported {import_mbox(store, path, label, args.jobs)} messages from {path} as {label}")
+
+    if args.daemon:
+        run_daemon(args.interval, args.max_results, args.offline, models_dir, holdout_percent=args.holdout_percent,
+                   max_accuracy_drop=args.max_accuracy_drop, keep_versions=args.keep_versions, max_age_days=args.max_age_days)
+    elif args.profile:
+        run_profiled(train_NB_classifier, args.max_results, args.offline, models_dir)
+        print("=== timers and counters ===", file=sys.stderr)
+        print(metrics.to_json(), file=sys.stderr)
+    else:
+        train_NB_classifier(args.max_results, args.offline, models_dir)
+    if args.metrics:
+        metrics.write(args.metrics)
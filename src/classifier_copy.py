@@ -1,23 +1,243 @@
+import heapq
 import math
+import os
+import tempfile
+import time
 from collections import Counter
+from functools import lru_cache
+from itertools import chain, islice, repeat
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from concurrent.futures import ProcessPoolExecutor
+
+from src.feature_hashing import FeatureHasher
+from src.label_encoder import LabelEncoder
+from src.metrics import get_metrics
+from src.model_format import MappedCounts, MappedVocabulary, is_model_file, read_model, write_model
+from src.tokenizer import Tokenizer
+
+WEIGHTINGS = ('tf', 'tfidf', 'tf_norm', 'tfidf_norm')
+# Weightings that collect document frequencies, and those that length-normalize each email's counts
+IDF_WEIGHTINGS = ('tfidf', 'tfidf_norm')
+NORMALIZED_WEIGHTINGS = ('tf_norm', 'tfidf_norm')
+TABLE_DTYPES = ('float64', 'float16', 'int8')
+FEATURE_SCORES = ('mutual_information', 'log_odds')
+DEFAULT_CLASSES = ('spam', 'ham')
+
+# Flush buffered bucket ids into the hashed count arrays every this many tokens
+_HASHED_FLUSH_SIZE = 1 << 16
+
+def _count_shard(options, emails, labels):
+    """Count one shard of the corpus in a worker process, returning an unfinalized classifier"""
+    shard = TFNaiveBayesClassifier(**options)
+    shard._count_emails(zip(emails, labels))
+    return shard
+
+def _legacy_tokenizer():
+    """
+    Tokenization of models saved before the Tokenizer existed: fit() split on whitespace, lowercased and
+    stripped punctuation, keeping words that were all punctuation as empty tokens
+    """
+    return Tokenizer(case_folding='lower', min_length=0)
+
+def _quantize_int8(table):
+    """Linearly map each row of a float table onto int8, returning the codes and each row's (scale, offset)"""
+    if table.shape[1] == 0:
+        return table.astype(np.int8), np.tile([1.0, 0.0], (len(table), 1))
+    low, high = table.min(axis=1), table.max(axis=1)
+    scale = (high - low) / 254
+    scale[scale == 0] = 1.0
+    codes = np.round((table - low[:, None]) / scale[:, None] - 127).astype(np.int8)
+    return codes, np.column_stack((scale, low + 127 * scale))
+
+def _class_alias(label, getter):
+    """Read-only two-class attribute, e.g. spam_email_count for email_count at the row of 'spam'"""
+    def get(self):
+        if label not in self.label_encoder.classes:
+            raise AttributeError(f"This classifier has no '{label}' class")
+        return getter(self, self.label_encoder.index(label))
+    return property(get)
 
 class TFNaiveBayesClassifier:
-    def __init__(self, laplace_smoothing_factor=1):
+    def __init__(self, laplace_smoothing_factor=1, tokenizer=None, n_features=None, hash_seed=0, weighting='tf',
+                 log_ratio_cache_size=None, classes=DEFAULT_CLASSES, hash_function='blake2b'):
         self.laplace_smoothing_factor = laplace_smoothing_factor
         if self.laplace_smoothing_factor <= 0:
             raise ValueError("Laplace smoothing factor must be greater than 0")
-        
-        self.spam_word_count = Counter()
-        self.ham_word_count = Counter()
-        self.total_words_in_spam = 0
-        self.total_words_in_ham = 0
-        self.p_spam = 0.0
-        self.p_ham = 0.0
-        self.vocab = set()
+        if weighting not in WEIGHTINGS:
+            raise ValueError(f"Weighting must be one of {WEIGHTINGS}")
+        # 'tfidf' scales each word's counts by its smoothed inverse document frequency. The '_norm' variants
+        # divide each email's counts by its length first, so long emails do not dominate the word estimates
+        self.weighting = weighting
+        # Shared by training and classification so both see identical tokens
+        self.tokenizer = tokenizer if tokenizer is not None else Tokenizer()
+        # Labels are validated and mapped to table rows; row order is the column order of predict_proba_batch()
+        self.label_encoder = LabelEncoder(classes)
+        self.classes = self.label_encoder.classes
+        n_classes = len(self.classes)
+
+        # Per-class totals, one entry per class
+        self.total_word_count = np.zeros(n_classes, dtype=np.int64)
+        self.email_count = np.zeros(n_classes, dtype=np.int64)
+        # Counts of words removed by compact(), kept as one out-of-vocabulary pseudo-word per class
+        self.pruned_word_count = np.zeros(n_classes, dtype=np.int64)
+        # The same for the length-normalized counts
+        self.pruned_normalized_count = np.zeros(n_classes)
+        self.class_priors = np.zeros(n_classes)
+        # False for models from before email counts were recorded: their priors are kept as loaded and
+        # they cannot be trained further, since new emails would outweigh every earlier one
+        self.email_counts_known = True
+        # Emails seen; differs from email_count.sum() when emails carry several labels
+        self.document_count = 0
+        # word -> column of the count arrays; new words are appended and the columns are put in sorted word
+        # order whenever the scoring tables are rebuilt, see _sort_vocab
+        self.vocab = {}
         self.vocab_size = 0
         self.is_fitted = False
-        
-    def fit(self,emails, labels):
+        # (n_classes x capacity) word counts and per-column document frequencies (only collected with the
+        # tf-idf weightings); capacity grows geometrically as new words arrive, see word_counts
+        self._word_count_buffer = np.zeros((n_classes, 0), dtype=np.int64)
+        self._document_frequency_buffer = np.zeros(0, dtype=np.int64)
+        # Sums of every email's counts divided by its length, only kept with the length-normalized weightings
+        self._normalized_count_buffer = np.zeros((n_classes, 0)) if weighting in NORMALIZED_WEIGHTINGS else None
+        # Frozen (n_classes x vocab) log P(word|Class) tables for scoring, built at the end of fit()
+        self.log_prob = np.zeros((n_classes, 0))
+        self.unseen_log_prob = np.zeros(n_classes)
+        self.idf = np.zeros(0)
+        # compact() can store the tables as float16 or int8; int8 values decode as value * scale + offset,
+        # with one (scale, offset) row per class
+        self.table_dtype = 'float64'
+        self.table_scales = np.tile([1.0, 0.0], (n_classes, 1))
+        # Hashing-trick mode: counts live in fixed arrays of n_features buckets and no vocabulary is kept
+        self.n_features = n_features
+        self.hash_seed = hash_seed
+        # 'crc32' only for models hashed before the keyed hash, see FeatureHasher
+        self.hash_function = hash_function
+        self.hasher = None
+        if n_features is not None:
+            self.hasher = FeatureHasher(n_features, hash_seed, hash_function)
+            self.vocab = None
+            self._word_count_buffer = np.zeros((n_classes, n_features), dtype=np.int64)
+            self._document_frequency_buffer = np.zeros(n_features, dtype=np.int64)
+            if self._normalized_count_buffer is not None:
+                self._normalized_count_buffer = np.zeros((n_classes, n_features))
+            self.log_prob = np.zeros((n_classes, n_features))
+        # Optional LRU cache of per-token log-likelihood ratios for the scalar classify() path
+        self._log_ratio_cache_totals = [0, 0]
+        self.set_log_ratio_cache_size(log_ratio_cache_size)
+
+    # Attribute names from when the classifier only knew 'spam' and 'ham', kept for two-class models
+    spam_word_count = _class_alias('spam', lambda self, row: MappedCounts(self.token_index, self.word_counts[row]))
+    ham_word_count = _class_alias('ham', lambda self, row: MappedCounts(self.token_index, self.word_counts[row]))
+    total_words_in_spam = _class_alias('spam', lambda self, row: int(self.total_word_count[row]))
+    total_words_in_ham = _class_alias('ham', lambda self, row: int(self.total_word_count[row]))
+    spam_email_count = _class_alias('spam', lambda self, row: int(self.email_count[row]))
+    ham_email_count = _class_alias('ham', lambda self, row: int(self.email_count[row]))
+    p_spam = _class_alias('spam', lambda self, row: float(self.class_priors[row]))
+    p_ham = _class_alias('ham', lambda self, row: float(self.class_priors[row]))
+
+    @property
+    def token_index(self):
+        """token -> column map shared by the counts and the scoring tables (the hasher in hashing mode)"""
+        return self.hasher if self.n_features is not None else self.vocab
+
+    @property
+    def word_counts(self):
+        """(n_classes x vocab) word counts; (n_classes x n_features) bucket counts in hashing mode"""
+        return self._word_count_buffer[:, :len(self.token_index)]
+
+    @property
+    def document_frequencies(self):
+        """Number of emails each word (or bucket) appears in, aligned with the columns of word_counts"""
+        return self._document_frequency_buffer[:len(self.token_index)]
+
+    @property
+    def normalized_counts(self):
+        """(n_classes x vocab) sums of length-normalized word counts, aligned with the columns of word_counts"""
+        return self._normalized_count_buffer[:, :len(self.token_index)]
+
+    @property
+    def document_frequency(self):
+        """word -> document frequency view of document_frequencies"""
+        return MappedCounts(self.token_index, self.document_frequencies)
+
+    def __getstate__(self):
+        # The lru_cache wrapper and the log-ratio view cannot be pickled; they are rebuilt on unpickling
+        state = self.__dict__.copy()
+        state.pop('_log_ratio', None)
+        state.pop('_log_ratios', None)
+        info = self.log_ratio_cache_info() if '_log_ratio' in self.__dict__ else None
+        if info is not None:
+            state['_log_ratio_cache_totals'] = [info['hits'], info['misses']]
+        return state
+
+    def __setstate__(self, state):
+        if 'label_encoder' not in state:
+            # A pickle of the spam/ham-only classifier with Counter or per-class array counts
+            state = TFNaiveBayesClassifier._from_two_class_state(state).__dict__
+        self.__dict__.update(state)
+        # Pickles written before the cache existed lack its settings
+        self.__dict__.setdefault('log_ratio_cache_size', None)
+        self.__dict__.setdefault('_log_ratio_cache_totals', [0, 0])
+        # N-class pickles always counted emails, and hashed with crc32 if at all
+        self.__dict__.setdefault('email_counts_known', True)
+        self.__dict__.setdefault('hash_function', 'crc32')
+        # ...and predate the length-normalized weightings
+        self.__dict__.setdefault('_normalized_count_buffer', None)
+        self.__dict__.setdefault('pruned_normalized_count', np.zeros(len(self.classes)))
+        self._reset_log_ratio_cache()
+
+    @staticmethod
+    def _from_two_class_state(state):
+        """
+        Rebuild a classifier from the attribute dict of a pickled spam/ham-only classifier, from the original
+        Counter-based one onwards. Attributes added along the way fall back to the behaviour before they existed.
+        """
+        tokenizer = state.get('tokenizer') or _legacy_tokenizer()
+        classifier = TFNaiveBayesClassifier(state['laplace_smoothing_factor'], tokenizer, state.get('n_features'),
+                                            state.get('hash_seed', 0), state.get('weighting', 'tf'), hash_function='crc32')
+        if classifier.n_features is not None:
+            classifier._word_count_buffer = np.vstack((state['spam_hashed_counts'], state['ham_hashed_counts']))
+            # Hashed models only collect document frequencies since tf-idf weighting was added
+            classifier._document_frequency_buffer = state.get('hashed_document_frequency', np.zeros(classifier.n_features, dtype=np.int64))
+        else:
+            spam_word_count, ham_word_count = state['spam_word_count'], state['ham_word_count']
+            document_frequency = state.get('document_frequency', {})
+            classifier.vocab = {word: index for index, word in enumerate(sorted(state['vocab']))}
+            classifier._word_count_buffer = np.array(
+                [[class_word_count.get(word, 0) for word in classifier.vocab] for class_word_count in (spam_word_count, ham_word_count)],
+                dtype=np.int64).reshape(2, len(classifier.vocab))
+            classifier._document_frequency_buffer = np.fromiter(
+                (document_frequency.get(word, 0) for word in classifier.vocab), dtype=np.int64, count=len(classifier.vocab))
+        classifier.total_word_count[:] = (state['total_words_in_spam'], state['total_words_in_ham'])
+        classifier.email_count[:] = (state.get('spam_email_count', 0), state.get('ham_email_count', 0))
+        # The oldest classifiers did not count emails and only kept the priors
+        classifier.email_counts_known = 'spam_email_count' in state
+        if not classifier.email_counts_known:
+            classifier.class_priors[:] = (state['p_spam'], state['p_ham'])
+        classifier.pruned_word_count[:] = (state.get('pruned_words_in_spam', 0), state.get('pruned_words_in_ham', 0))
+        classifier.document_count = int(classifier.email_count.sum())
+        classifier.table_dtype = state.get('table_dtype', 'float64')
+        classifier.log_ratio_cache_size = state.get('log_ratio_cache_size')
+        # The original classifier only set is_fitted on its first classification, so a trained vocabulary counts too
+        if state.get('is_fitted') or state.get('vocab'):
+            classifier._update_model()
+        return classifier
+
+    def _init_options(self):
+        """Constructor arguments that give an empty classifier compatible with this one"""
+        return {
+            'laplace_smoothing_factor': self.laplace_smoothing_factor,
+            'tokenizer': self.tokenizer,
+            'n_features': self.n_features,
+            'hash_seed': self.hash_seed,
+            'weighting': self.weighting,
+            'classes': self.classes,
+            'hash_function': self.hash_function,
+        }
+
+    def fit(self,emails, labels, n_jobs=1):
         # Edge cases where .fit() method might fail due to invalid inputs
         if not isinstance(emails, list) or not isinstance(labels, list):
             raise ValueError("Emails and labels must be lists")
@@ -27,127 +247,842 @@ class TFNaiveBayesClassifier:
             raise ValueError("Emails and labels must have the same length")
         if self.is_fitted:
             raise RuntimeError("Classifier is already fitted. Create a new instance to fit again")
-        
-        # Uncomment the following lines if you want to reset the classifier before fitting
-        # self.spam_word_count.clear()
-        # self.ham_word_count.clear()
-        # self.total_words_in_spam = 0
-        # self.total_words_in_ham = 0
-        # self.vocab.clear()
-        
-        spam_emails = {email: {'content': emails[i]} for i, email in enumerate(emails) if labels[i] == 'spam'}
-        ham_emails = {email: {'content': emails[i]} for i, email in enumerate(emails) if labels[i] == 'ham'}
-        
-        for email in list(spam_emails.values()):
-            words = email['content'].split()
-            words = [word.lower() for word in words]  # Convert words to lowercase
-            words = [word.strip('.,!?;:"()[]}{') for word in words]
-            for word in words:
-                self.spam_word_count[word] += 1
-                self.total_words_in_spam += 1
-                self.vocab.add(word)
-
-        for email in list(ham_emails.values()):
-            words = email['content'].split()
-            words = [word.lower() for word in words]  # Convert words to lowercase
-            words = [word.strip('.,!?;:"()[]}{') for word in words]
-            for word in words:
-                self.ham_word_count[word] += 1
-                self.total_words_in_ham += 1
-                self.vocab.add(word)
+        # Reject unknown labels before counting anything
+        for label in labels:
+            self.label_encoder.encode(label)
+
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        metrics = get_metrics()
+        with metrics.timer('count_emails'):
+            if n_jobs > 1:
+                self._parallel_count_emails(emails, labels, n_jobs)
+            else:
+                self._count_emails(zip(emails, labels))
+        metrics.increment('emails_counted', len(emails))
+        self._update_model()
+
+    def _parallel_count_emails(self, emails, labels, n_jobs):
+        """Count contiguous shards of the corpus in worker processes and merge them back in order"""
+        # A few shards per worker keeps the pool busy when emails vary in length
+        n_shards = min(len(emails), n_jobs * 4)
+        shard_size = -(-len(emails) // n_shards)
+        starts = range(0, len(emails), shard_size)
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            shards = executor.map(
+                _count_shard,
+                [self._init_options()] * len(starts),
+                [emails[start:start + shard_size] for start in starts],
+                [labels[start:start + shard_size] for start in starts],
+            )
+            for shard in shards:
+                self._merge_counts(shard)
+
+    def merge(self, other):
+        """
+        Combine the counts of another classifier into this one, e.g. models trained per day or per mailbox.
+        The result is identical to training a single model on both corpora.
+        """
+        if not isinstance(other, TFNaiveBayesClassifier):
+            raise ValueError("Can only merge with another TFNaiveBayesClassifier")
+        if other.laplace_smoothing_factor != self.laplace_smoothing_factor:
+            raise ValueError("Cannot merge classifiers with different Laplace smoothing factors")
+        if other.tokenizer != self.tokenizer:
+            raise ValueError("Cannot merge classifiers with different tokenizers")
+        if (other.n_features, other.hash_seed, other.hash_function) != (self.n_features, self.hash_seed, self.hash_function):
+            raise ValueError("Cannot merge classifiers with different feature hashing settings")
+        if other.weighting != self.weighting:
+            raise ValueError("Cannot merge classifiers with different weightings")
+        if other.classes != self.classes:
+            raise ValueError("Cannot merge classifiers with different classes")
+        self._check_email_counts()
+        other._check_email_counts()
+        self._thaw()
+        self._merge_counts(other)
+        self._update_model()
+        return self
+
+    def _merge_counts(self, other):
+        """Add the raw word and document counts of another classifier to this one"""
+        if self.n_features is not None:
+            columns = slice(None)
+        else:
+            # Words new to this vocabulary are appended, then all of the other model's columns are added at once
+            self._add_words(other.vocab)
+            columns = np.fromiter(map(self.vocab.__getitem__, other.vocab), dtype=np.intp, count=len(other.vocab))
+        self._word_count_buffer[:, columns] += other.word_counts
+        self._document_frequency_buffer[columns] += other.document_frequencies
+        if self._normalized_count_buffer is not None:
+            self._normalized_count_buffer[:, columns] += other.normalized_counts
+        self.total_word_count += other.total_word_count
+        self.email_count += other.email_count
+        self.pruned_word_count += other.pruned_word_count
+        self.pruned_normalized_count += other.pruned_normalized_count
+        self.document_count += other.document_count
+
+    def partial_fit(self, email_label_pairs, chunk_size=10000):
+        """
+        Incrementally train on any iterable of (email, label) pairs, e.g. a generator over a file.
+        An email may also be given as an already tokenized list of words (see EmailStore.iter_training_pairs),
+        and a label may be a list of classes for multi-label emails.
+        Only `chunk_size` emails are held in memory at a time. Can be called repeatedly; priors,
+        vocab_size and document counts always reflect every email seen so far. A chunk with an unknown
+        label raises ValueError without being counted; the chunks before it stay counted and the model
+        is left ready to use.
+        """
+        if chunk_size <= 0:
+            raise ValueError("Chunk size must be greater than 0")
+        self._check_email_counts()
+        self._thaw()
+
+        metrics = get_metrics()
+        pairs = iter(email_label_pairs)
+        try:
+            while True:
+                chunk = list(islice(pairs, chunk_size))
+                if not chunk:
+                    break
+                with metrics.timer('count_emails'):
+                    self._count_emails(chunk)
+                metrics.increment('emails_counted', len(chunk))
+        finally:
+            # Rebuild the tables from whatever was counted, also when a later chunk or the source raises,
+            # so they always match the vocabulary
+            if self.is_fitted or self.document_count:
+                self._update_model()
+        return self
+
+    def update_classifier(self, spam_emails, ham_emails):
+        """Update the classifier with new spam and ham emails"""
+        self.partial_fit(chain(((email, 'spam') for email in spam_emails), ((email, 'ham') for email in ham_emails)))
+
+    def _check_email_counts(self):
+        """Refuse further training of a model whose priors cannot be updated"""
+        if not self.email_counts_known:
+            raise RuntimeError("This model was saved before email counts were recorded, so its priors cannot be "
+                               "updated. Fit a new classifier instead.")
+
+    def _count_emails(self, email_label_pairs):
+        """Add the word and document counts of (email, label) pairs to the model"""
+        if self.n_features is not None:
+            self._count_hashed_emails(email_label_pairs)
+            return
+        tokenize = get_metrics().timed('tokenize', self.tokenizer)
+        encode = self.label_encoder.encode
+        collect_document_frequency = self.weighting in IDF_WEIGHTINGS
+        normalize = self._normalized_count_buffer is not None
+        # Count into one Counter per class, then add them to the count array once per distinct word.
+        # Nothing is stored until every label has been validated.
+        class_word_counts = [Counter() for _ in self.classes]
+        class_normalized_counts = [Counter() for _ in self.classes]
+        document_frequency = Counter()
+        email_count = [0] * len(self.classes)
+        total_word_count = [0] * len(self.classes)
+        document_count = 0
+        for email_content, label in email_label_pairs:
+            rows = encode(label)
+            words = email_content if isinstance(email_content, list) else tokenize(email_content)
+            for row in rows:
+                class_word_counts[row].update(words)
+                email_count[row] += 1
+                total_word_count[row] += len(words)
+            document_count += 1
+            if collect_document_frequency:
+                document_frequency.update(set(words))
+            if normalize and words:
+                weight = 1 / len(words)
+                term_weights = {word: count * weight for word, count in Counter(words).items()}
+                for row in rows:
+                    class_normalized_counts[row].update(term_weights)
+
+        for class_word_count in class_word_counts:
+            self._add_words(class_word_count)
+        for row, class_word_count in enumerate(class_word_counts):
+            if class_word_count:
+                columns = np.fromiter(map(self.vocab.__getitem__, class_word_count), dtype=np.intp, count=len(class_word_count))
+                self._word_count_buffer[row, columns] += np.fromiter(class_word_count.values(), dtype=np.int64, count=len(class_word_count))
+                if normalize:
+                    normalized_count = class_normalized_counts[row]
+                    self._normalized_count_buffer[row, columns] += np.fromiter(
+                        map(normalized_count.__getitem__, class_word_count), dtype=np.float64, count=len(class_word_count))
+        if document_frequency:
+            columns = np.fromiter(map(self.vocab.__getitem__, document_frequency), dtype=np.intp, count=len(document_frequency))
+            self._document_frequency_buffer[columns] += np.fromiter(document_frequency.values(), dtype=np.int64, count=len(document_frequency))
+        self.email_count += email_count
+        self.total_word_count += total_word_count
+        self.document_count += document_count
+
+    def _add_words(self, words):
+        """Give every word not yet in the vocabulary the next free column, growing the count arrays if needed"""
+        vocab = self.vocab
+        new_words = [word for word in words if word not in vocab]
+        vocab.update(zip(new_words, range(len(vocab), len(vocab) + len(new_words))))
+        capacity = self._word_count_buffer.shape[1]
+        if len(vocab) > capacity:
+            # Geometric growth keeps adding words amortized O(1)
+            capacity = max(len(vocab), 2 * capacity, 1024)
+            word_count_buffer = np.zeros((len(self.classes), capacity), dtype=np.int64)
+            word_count_buffer[:, :self._word_count_buffer.shape[1]] = self._word_count_buffer
+            document_frequency_buffer = np.zeros(capacity, dtype=np.int64)
+            document_frequency_buffer[:len(self._document_frequency_buffer)] = self._document_frequency_buffer
+            self._word_count_buffer, self._document_frequency_buffer = word_count_buffer, document_frequency_buffer
+            if self._normalized_count_buffer is not None:
+                normalized_count_buffer = np.zeros((len(self.classes), capacity))
+                normalized_count_buffer[:, :self._normalized_count_buffer.shape[1]] = self._normalized_count_buffer
+                self._normalized_count_buffer = normalized_count_buffer
+
+    def _count_hashed_emails(self, email_label_pairs):
+        """Hashed-mode counting: buffer bucket ids per class and add them to the count arrays with bincount"""
+        tokenize = get_metrics().timed('tokenize', self.tokenizer)
+        encode = self.label_encoder.encode
+        bucket = self.hasher.get
+        collect_document_frequency = self.weighting in IDF_WEIGHTINGS
+        normalize = self._normalized_count_buffer is not None
+        # Buffered bucket ids are flushed as they pile up, so every label is checked before anything is counted
+        pairs = [(email_content, encode(label)) for email_content, label in email_label_pairs]
+        class_buckets = [[] for _ in self.classes]
+        # With the length-normalized weightings, the weight (1 / email length) of every buffered bucket id
+        class_weights = [[] for _ in self.classes]
+        document_buckets = []
+        email_count = [0] * len(self.classes)
+        total_word_count = [0] * len(self.classes)
+        document_count = 0
+
+        def flush():
+            # The totals are flushed with the buckets, so counts and totals always describe the same emails
+            nonlocal document_count
+            for row, buckets in enumerate(class_buckets):
+                if buckets:
+                    buckets = np.asarray(buckets, dtype=np.int64)
+                    self._word_count_buffer[row] += np.bincount(buckets, minlength=self.n_features)
+                    if normalize:
+                        self._normalized_count_buffer[row] += np.bincount(buckets, weights=class_weights[row], minlength=self.n_features)
+                    class_buckets[row].clear()
+                    class_weights[row].clear()
+            self._document_frequency_buffer += np.bincount(np.asarray(document_buckets, dtype=np.int64), minlength=self.n_features)
+            document_buckets.clear()
+            self.email_count += email_count
+            self.total_word_count += total_word_count
+            self.document_count += document_count
+            email_count[:] = total_word_count[:] = [0] * len(self.classes)
+            document_count = 0
+
+        pending = 0
+        for email_content, rows in pairs:
+            words = email_content if isinstance(email_content, list) else tokenize(email_content)
+            buckets = list(map(bucket, words))
+            for row in rows:
+                class_buckets[row].extend(buckets)
+                if normalize and words:
+                    class_weights[row].extend(repeat(1 / len(words), len(words)))
+                email_count[row] += 1
+                total_word_count[row] += len(words)
+            document_count += 1
+            if collect_document_frequency:
+                document_buckets.extend(set(buckets))
+            pending += len(buckets) * len(rows)
+            if pending >= _HASHED_FLUSH_SIZE:
+                flush()
+                pending = 0
+        flush()
+
+    def _update_model(self):
+        """Recompute vocab_size, priors and the frozen scoring tables from the current counts"""
+        total_emails = self.email_count.sum()
+        if isinstance(self.vocab, dict):
+            self._sort_vocab()
+        if self.n_features is not None:
+            # Occupied buckets stand in for distinct words
+            self.vocab_size = int(np.count_nonzero(self.word_counts.any(axis=0)))
+        else:
+            self.vocab_size = len(self.vocab)
+        if self.email_counts_known:
+            self.class_priors = (self.email_count + self.laplace_smoothing_factor) / (total_emails + self.laplace_smoothing_factor * len(self.classes))
+        with get_metrics().timer('build_tables'):
+            self._build_log_probability_tables()
+        self.is_fitted = True
+
+    def _sort_vocab(self):
+        """
+        Renumber the columns in sorted word order, so a model does not depend on how its emails were split into
+        chunks, shards or merged models: serial and parallel fits give identical columns and model files
+        """
+        words = sorted(self.vocab)
+        if words == list(self.vocab):
+            return
+        columns = np.fromiter(map(self.vocab.__getitem__, words), dtype=np.intp, count=len(words))
+        self._word_count_buffer = self._word_count_buffer[:, columns]
+        self._document_frequency_buffer = self._document_frequency_buffer[columns]
+        if self._normalized_count_buffer is not None:
+            self._normalized_count_buffer = self._normalized_count_buffer[:, columns]
+        self.vocab = dict(zip(words, range(len(words))))
+
+    def _build_log_probability_tables(self):
+        """Freeze the counts into (n_classes x vocab) log P(word|Class) tables for scoring"""
+        counts = self.word_counts.astype(np.float64)
+        # Words pruned by compact() are pooled into one out-of-vocabulary word, weighted like the others
+        pruned_count = self.pruned_word_count.astype(np.float64)
+        if self.weighting in NORMALIZED_WEIGHTINGS:
+            counts = self.normalized_counts
+            pruned_count = self.pruned_normalized_count
+        if self.weighting in IDF_WEIGHTINGS:
+            # Smoothed idf, as in sklearn: log((1 + n_emails) / (1 + df)) + 1. Since idf is constant per word,
+            # summing idf-weighted term counts over emails is just idf times the class counts.
+            self.idf = np.log((1 + self.document_count) / (1 + self.document_frequencies.astype(np.float64))) + 1
+            unseen_idf = math.log(1 + self.document_count) + 1
+            counts = counts * self.idf
+            # Pruned words are scored as unseen words, so their pooled count takes the unseen idf
+            pruned_count = pruned_count * unseen_idf
+        if self.weighting in NORMALIZED_WEIGHTINGS:
+            # Each email now weighs 1 in total; scale back to the corpus's token count so the Laplace
+            # smoothing keeps the weight it has against raw counts
+            weight = counts.sum() + pruned_count.sum()
+            scale = self.total_word_count.sum() / weight if weight else 1.0
+            counts, pruned_count = counts * scale, pruned_count * scale
+        total_word_count = counts.sum(axis=1) + pruned_count if self.weighting != 'tf' else self.total_word_count.astype(np.float64)
+
+        smoothed_vocab_size = self.vocab_size + (1 if self.pruned_word_count.any() else 0)
+        denominators = total_word_count + self.laplace_smoothing_factor * smoothed_vocab_size
+        self.log_prob = np.log((counts + self.laplace_smoothing_factor) / denominators[:, None])
+        # Words never seen in training (or pruned) all share the same smoothed probability
+        self.unseen_log_prob = np.log((pruned_count + self.laplace_smoothing_factor) / denominators)
+        if self.weighting == 'tfidf':
+            # Fold the idf weights into the tables so scoring a count vector applies them with no extra work.
+            # 'tfidf_norm' only uses idf to estimate the tables and scores raw counts: weighting the scored
+            # tokens by idf as well mostly amplifies the noise of rare words.
+            self.log_prob *= self.idf
+            self.unseen_log_prob *= unseen_idf
+        self._quantize_tables()
+        # Cached log-ratios were computed from the old tables
+        self._reset_log_ratio_cache()
+
+    def _quantize_tables(self):
+        """Convert the float64 scoring tables to the configured table_dtype"""
+        self.table_scales = np.tile([1.0, 0.0], (len(self.classes), 1))
+        if self.table_dtype == 'float16':
+            self.log_prob = self.log_prob.astype(np.float16)
+        elif self.table_dtype == 'int8':
+            self.log_prob, self.table_scales = _quantize_int8(self.log_prob)
+
+    def _decoded_columns(self, columns):
+        """float64 (n_classes x len(columns)) block of the scoring tables"""
+        table = self.log_prob.take(columns, axis=1)
+        if table.dtype == np.int8:
+            return table * self.table_scales[:, :1] + self.table_scales[:, 1:]
+        return table.astype(np.float64)
+
+    def _decoded_row(self, row):
+        """float64 scoring table of one class"""
+        if self.log_prob.dtype == np.float64:
+            return self.log_prob[row]
+        scale, offset = self.table_scales[row].tolist()
+        return self.log_prob[row].astype(np.float64) * scale + offset
+
+    def _table_scores(self, counts):
+        """(n_emails x n_classes) sums of each row of a sparse count matrix against every class's table"""
+        # One sparse matrix-vector product per class reads its table row in place; a product with the
+        # transposed (vocab x n_classes) table would copy all of it first, on every call
+        if self.log_prob.dtype == np.float64:
+            return np.column_stack([counts @ row for row in self.log_prob])
+        if self.log_prob.size <= counts.nnz:
+            # The batch touches most columns anyway, so decode one class row at a time, which costs less than
+            # the batch's count matrix already did
+            return np.column_stack([counts @ self._decoded_row(row) for row in range(len(self.classes))])
+        # Otherwise gather only the entries each email uses, so compact tables are never expanded to float64
+        # as a whole: weight the gathered entries by the counts, then sum them per email and class
+        n_emails, n_classes = counts.shape[0], self.log_prob.shape[0]
+        # Email of every entry, offset per class so a single bincount sums all classes at once
+        rows = np.repeat(np.arange(n_emails), np.diff(counts.indptr)) + n_emails * np.arange(n_classes)[:, None]
+        values = self._decoded_columns(counts.indices) * counts.data
+        return np.bincount(rows.ravel(), weights=values.ravel(), minlength=n_classes * n_emails).reshape(n_classes, n_emails).T
+
+    def compact(self, min_count=None, min_document_frequency=None, top_k=None, method='mutual_information',
+                table_dtype=None, validation_emails=None, validation_labels=None):
+        """
+        Shrink the model after fitting. Words can be pruned by total count, by document frequency (needs
+        a tf-idf weighting, the only ones that collect it) or by keeping the `top_k` words ranked by
+        token-level mutual information with the class or by the spread of their log-probabilities across
+        classes ('log_odds'). Pruned words leave the vocabulary, shrinking vocab_size, and their counts are
+        pooled into one out-of-vocabulary word per class that unseen words are scored with.
+        `table_dtype` ('float16' or 'int8') stores the scoring tables compactly; the setting is kept
+        across later training. Returns a report of the size change and, when validation emails and labels
+        are given, of the change in accuracy, in model file load time and in how fast the loaded model
+        scores the validation emails.
+        """
+        if not self.is_fitted:
+            raise RuntimeError("Classifier is not fitted yet. Call fit() method before compacting.")
+        if table_dtype is not None and table_dtype not in TABLE_DTYPES:
+            raise ValueError(f"Table dtype must be one of {TABLE_DTYPES}")
+        if method not in FEATURE_SCORES:
+            raise ValueError(f"Method must be one of {FEATURE_SCORES}")
+        pruning = min_count is not None or min_document_frequency is not None or top_k is not None
+        if pruning and self.n_features is not None:
+            raise ValueError("Pruning is not supported in hashing mode, use a smaller n_features instead")
+        if min_document_frequency is not None and self.weighting not in IDF_WEIGHTINGS:
+            raise ValueError(f"Document frequencies are only collected with weighting in {IDF_WEIGHTINGS}")
+
+        report = {'vocab_size_before': self.vocab_size, 'table_bytes_before': self.log_prob.nbytes}
+        if validation_emails is not None:
+            report['accuracy_before'] = self.score(validation_emails, validation_labels)
+            report['load_seconds_before'], report['loaded_batch_docs_per_second_before'] = self._loaded_speed(validation_emails)
+
+        self._thaw()
+        if pruning:
+            self._prune(min_count, min_document_frequency, top_k, method)
+        if table_dtype is not None:
+            self.table_dtype = table_dtype
+        self._update_model()
 
-        self.vocab_size = len(self.vocab)
-        self.p_spam = (len(spam_emails) + self.laplace_smoothing_factor) / (len(spam_emails) + len(ham_emails) + self.laplace_smoothing_factor * 2)
-        self.p_ham = (len(ham_emails) + self.laplace_smoothing_factor) / (len(spam_emails) + len(ham_emails) + self.laplace_smoothing_factor * 2)
+        report.update(vocab_size_after=self.vocab_size, table_bytes_after=self.log_prob.nbytes)
+        if validation_emails is not None:
+            report['accuracy_after'] = self.score(validation_emails, validation_labels)
+            report['load_seconds_after'], report['loaded_batch_docs_per_second_after'] = self._loaded_speed(validation_emails)
+        return report
+
+    def _loaded_speed(self, emails):
+        """Seconds to load this model from a model file, and emails per second the loaded model scores"""
+        emails = list(emails)
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'model.nbm')
+            self.save_model(file_path)
+            start = time.perf_counter()
+            loaded = TFNaiveBayesClassifier.load_model(file_path)
+            load_seconds = time.perf_counter() - start
+            # The loaded model reads its tables from a memory map, as a deployed model does
+            start = time.perf_counter()
+            loaded.predict_proba_batch(emails)
+            batch_seconds = time.perf_counter() - start
+            del loaded
+        return load_seconds, len(emails) / batch_seconds if batch_seconds else None
+
+    def _prune(self, min_count, min_document_frequency, top_k, method):
+        """Drop the words that fail the compaction criteria, pooling their counts into the pruned totals"""
+        counts = self.word_counts
+        keep = np.ones(counts.shape[1], dtype=bool)
+        if min_count is not None:
+            keep &= counts.sum(axis=0) >= min_count
+        if min_document_frequency is not None:
+            keep &= self.document_frequencies >= min_document_frequency
+        if top_k is not None and keep.sum() > top_k:
+            scores = self._feature_scores(counts, method)
+            scores[~keep] = -np.inf
+            keep = np.zeros(counts.shape[1], dtype=bool)
+            keep[np.argpartition(-scores, top_k - 1)[:top_k]] = True
+
+        self.pruned_word_count += counts[:, ~keep].sum(axis=1)
+        # Surviving words keep their relative order and are renumbered from 0
+        kept = np.flatnonzero(keep)
+        words = list(self.vocab)
+        if self._normalized_count_buffer is not None:
+            self.pruned_normalized_count += self.normalized_counts[:, ~keep].sum(axis=1)
+            self._normalized_count_buffer = self.normalized_counts[:, kept]
+        self._word_count_buffer = counts[:, kept]
+        self._document_frequency_buffer = self.document_frequencies[kept]
+        self.vocab = {words[column]: index for index, column in enumerate(kept)}
+
+    def _feature_scores(self, counts, method):
+        """Rank words (columns of the class x word count matrix) by how much they tell the classes apart"""
+        counts = counts.astype(np.float64)
+        if method == 'log_odds':
+            alpha = self.laplace_smoothing_factor
+            log_probabilities = np.log((counts + alpha) / (counts.sum(axis=1, keepdims=True) + alpha * counts.shape[1]))
+            # |log P(w|c1) - log P(w|c2)| for two classes, the widest gap between any two classes in general
+            return log_probabilities.max(axis=0) - log_probabilities.min(axis=0)
+
+        # Mutual information between a token occurrence's word and its class:
+        # sum over classes of P(w, c) * log(P(w, c) / (P(w) * P(c)))
+        total = counts.sum()
+        word_probability = counts.sum(axis=0) / total
+        class_probability = counts.sum(axis=1, keepdims=True) / total
+        joint = counts / total
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(joint > 0, joint * np.log(joint / (word_probability * class_probability)), 0.0).sum(axis=0)
 
     def get_word_probability(self,word,class_word_count_dict,total_words_in_class):
         """Calculate the P(word|Class) with laplace smoothing"""
         word_count = class_word_count_dict.get(word, 0)
         probability = (word_count + self.laplace_smoothing_factor)/(total_words_in_class + self.laplace_smoothing_factor*self.vocab_size)
         return probability
-    
+
     def get_word_probability_total(self, word):
-        """Calculate the P(word) occuring in the training set = P(word|spam) * P(spam) + P(word|ham) * P(ham)"""
-        spam_probability = self.get_word_probability(word, self.spam_word_count, self.total_words_in_spam)
-        ham_probability = self.get_word_probability(word, self.ham_word_count, self.total_words_in_ham)
-        total_probability = spam_probability * self.p_spam + ham_probability * self.p_ham
+        """Calculate the P(word) occuring in the training set = sum over classes of P(word|Class) * P(Class)"""
+        column = self.token_index.get(word)
+        word_counts = self.word_counts[:, column] if column is not None else 0
+        probabilities = (word_counts + self.laplace_smoothing_factor) / (self.total_word_count + self.laplace_smoothing_factor * self.vocab_size)
+        total_probability = float(probabilities @ self.class_priors)
         return total_probability
-    
-    def classification_probability(self, email_content):
-        """Classify the email content as spam or ham"""
-        words = email_content.lower().split()
-        
-        # probability_spam_given_words = self.p_spam
-        # probability_ham_given_words = self.p_ham
-        
-        log_probability_spam = math.log(self.p_spam)
-        log_probability_ham = math.log(self.p_ham)
-        
+
+    def set_log_ratio_cache_size(self, maxsize):
+        """
+        Cache log P(word|first class) - log P(word|second class) (spam vs ham by default) for up to `maxsize`
+        tokens in classify() of a two-class model, evicting the least recently used. None or 0 turns the
+        cache off. The cache is cleared whenever the counts change.
+        """
+        if maxsize is not None and maxsize < 0:
+            raise ValueError("Cache size must be a non-negative integer or None")
+        self.log_ratio_cache_size = maxsize or None
+        self._reset_log_ratio_cache()
+
+    def _reset_log_ratio_cache(self):
+        """Start an empty log-ratio cache, carrying its hit and miss counts over, and forget the log-ratios and their bounds"""
+        self._log_ratios = None
+        self._log_ratio_bounds = None
+        previous = getattr(self, '_log_ratio', None)
+        if hasattr(previous, 'cache_info'):
+            info = previous.cache_info()
+            self._log_ratio_cache_totals[0] += info.hits
+            self._log_ratio_cache_totals[1] += info.misses
+        if self.log_ratio_cache_size:
+            self._log_ratio = lru_cache(maxsize=self.log_ratio_cache_size)(self._word_log_ratio)
+        else:
+            self._log_ratio = self._word_log_ratio
+
+    def log_ratio_cache_info(self):
+        """Hits and misses since construction plus the current size of the log-ratio cache, or None when it is off"""
+        if not self.log_ratio_cache_size:
+            return None
+        info = self._log_ratio.cache_info()
+        return {
+            'hits': self._log_ratio_cache_totals[0] + info.hits,
+            'misses': self._log_ratio_cache_totals[1] + info.misses,
+            'maxsize': info.maxsize,
+            'currsize': info.currsize,
+        }
+
+    def _word_log_ratio(self, word):
+        """log P(word|first class) - log P(word|second class), the word's contribution to the log-odds of the first class"""
+        ratios, unseen_ratio = self._log_ratios or self._get_log_ratios()
+        column = self.token_index.get(word)
+        return unseen_ratio if column is None else ratios[column]
+
+    def _get_log_ratios(self):
+        """
+        Log-ratio of every column, and of unseen words, computed once per set of tables. The column ratios
+        are read through a memoryview, whose items are plain floats, so scoring a token is a single index.
+        """
+        if self._log_ratios is None:
+            ratios = self._decoded_row(0) - self._decoded_row(1)
+            self._log_ratios = (memoryview(ratios), float(self.unseen_log_prob[0] - self.unseen_log_prob[1]))
+        return self._log_ratios
+
+    def _get_log_ratio_bounds(self):
+        """Smallest and largest log-ratio between the two classes of any token, computed once per set of tables"""
+        if self._log_ratio_bounds is None:
+            ratios, unseen_ratio = self._get_log_ratios()
+            ratios = np.asarray(ratios)
+            self._log_ratio_bounds = (min(float(ratios.min(initial=unseen_ratio)), unseen_ratio),
+                                      max(float(ratios.max(initial=unseen_ratio)), unseen_ratio))
+        return self._log_ratio_bounds
+
+    def _sum_log_ratios(self, words, log_odds, confidence, top_n):
+        """
+        Add the words' log-ratios to log_odds, stopping once the remaining words cannot bring the leading
+        class below `confidence`, and keeping each word's total contribution when `top_n` is set.
+        Only ratios pointing away from the leader can erode its lead, so each side has its own bound.
+        """
+        log_ratio = self._log_ratio
+        contributions = Counter() if top_n else None
+        n_words = len(words)
+        if confidence is not None:
+            if not 0.5 < confidence < 1:
+                raise ValueError("Confidence must be between 0.5 and 1")
+            margin = math.log(confidence / (1 - confidence))
+            min_ratio, max_ratio = self._get_log_ratio_bounds()
+            # Largest amount a single word can move the log-odds towards the second class, and towards the first
+            max_second_pull, max_first_pull = max(-min_ratio, 0.0), max(max_ratio, 0.0)
+        n_scored = 0
         for word in words:
-            probability_word_given_spam = self.get_word_probability(word,self.spam_word_count,self.total_words_in_spam)
-            probability_word_given_ham = self.get_word_probability(word,self.ham_word_count,self.total_words_in_ham)
-            
-            # probability_spam_given_words *= probability_word_given_spam
-            # probability_ham_given_words *= probability_word_given_ham
-            
-            log_probability_spam += math.log(probability_word_given_spam)
-            log_probability_ham += math.log(probability_word_given_ham)
-            
+            ratio = log_ratio(word)
+            log_odds += ratio
+            n_scored += 1
+            if contributions is not None:
+                contributions[word] += ratio
+            # Even if every remaining word pulled as hard as possible against the leader, it would keep the lead
+            if confidence is not None and (log_odds - (n_words - n_scored) * max_second_pull >= margin or
+                                           -log_odds - (n_words - n_scored) * max_first_pull >= margin):
+                break
+
+        details = {}
+        if confidence is not None:
+            details.update(tokens_scored=n_scored, tokens_total=n_words, early_exit=n_scored < n_words)
+        if top_n:
+            details['top_tokens'] = heapq.nlargest(top_n, contributions.items(), key=lambda item: abs(item[1]))
+        return log_odds, details
+
+    def classification_probability(self, email_content, confidence=None, top_n=None):
+        """
+        Classify the email content, returning '<class>_probability' for every class (spam_probability and
+        ham_probability by default).
+        For two-class models, with `confidence` (e.g. 0.999) scoring stops as soon as the class in the lead
+        is certain to finish with at least that probability, even if every remaining token had the largest
+        log-ratio in the model; the result then also reports tokens_scored, tokens_total and early_exit, and
+        its probabilities are those of the tokens scored. With `top_n` the result lists, under top_tokens,
+        the (token, contribution to the log-odds of the first class) pairs with the largest absolute
+        contribution.
+        """
+        with get_metrics().timer('classify'):
+            return self._classification_probability(email_content, confidence, top_n)
+
+    def _classification_probability(self, email_content, confidence, top_n):
+        with get_metrics().timer('tokenize'):
+            words = self.tokenizer(email_content)
+        if len(self.classes) > 2:
+            if confidence is not None or top_n:
+                raise ValueError("Early exit and top contributing tokens need a two-class model")
+            return dict(zip(self._probability_keys(), self._multiclass_probabilities(words)))
+
+        # Only the difference between the two class scores matters, so sum the per-word log-likelihood
+        # ratios (cached when a log-ratio cache is configured) onto the prior log-odds
+        log_probability_first = math.log(self.class_priors[0]) - math.log(self.class_priors[1])
+        log_probability_second = 0.0
+
+        details = {}
+        if confidence is None and not top_n:
+            log_ratio = self._log_ratio
+            for word in words:
+                log_probability_first += log_ratio(word)
+        else:
+            log_probability_first, details = self._sum_log_ratios(words, log_probability_first, confidence, top_n)
+
         # Normalize the probabilities
-        # total_probability = probability_spam_given_words + probability_ham_given_words
-        max_log_probability = max(log_probability_spam, log_probability_ham)
-        
-        log_probability_spam -= max_log_probability
-        log_probability_ham -= max_log_probability
-        probability_spam_given_words = math.exp(log_probability_spam)
-        probability_ham_given_words = math.exp(log_probability_ham)
-        
-        total_probability = probability_spam_given_words + probability_ham_given_words
-        
+        max_log_probability = max(log_probability_first, log_probability_second)
+
+        log_probability_first -= max_log_probability
+        log_probability_second -= max_log_probability
+        probability_first_given_words = math.exp(log_probability_first)
+        probability_second_given_words = math.exp(log_probability_second)
+
+        total_probability = probability_first_given_words + probability_second_given_words
+
         #Final probabilities
-        probability_spam_given_words /= total_probability
-        probability_ham_given_words /= total_probability
-        
+        probability_first_given_words /= total_probability
+        probability_second_given_words /= total_probability
+
         self.is_fitted = True
-        
+
+        first_key, second_key = self._probability_keys()
         return {
-            'spam_probability': probability_spam_given_words,
-            'ham_probability': probability_ham_given_words
+            first_key: probability_first_given_words,
+            second_key: probability_second_given_words,
+            **details
         }
-        
-    def classify(self, email_content):
-        """Classify the email content as spam or ham"""
-        probabilities = self.classification_probability(email_content)
-        if probabilities['spam_probability'] > probabilities['ham_probability']:
-            return 'spam'
-        else:
-            return 'ham'
-        
+
+    def _multiclass_probabilities(self, words):
+        """Posterior of every class for one tokenized email, gathering its table columns in one step"""
+        token_index = self.token_index
+        columns = []
+        unseen = 0
+        for word in words:
+            column = token_index.get(word)
+            if column is None:
+                unseen += 1
+            else:
+                columns.append(column)
+        log_probabilities = np.log(self.class_priors) + self._decoded_columns(columns).sum(axis=1) + unseen * self.unseen_log_prob
+        probabilities = np.exp(log_probabilities - log_probabilities.max())
+        return (probabilities / probabilities.sum()).tolist()
+
+    def _probability_keys(self):
+        return [f'{label}_probability' for label in self.classes]
+
+    def classify(self, email_content, confidence=None):
+        """Classify the email content, returning the most probable class; two-class models can stop early at `confidence`"""
+        probabilities = self.classification_probability(email_content, confidence)
+        scores = [probabilities[key] for key in self._probability_keys()]
+        return self.classes[scores.index(max(scores))]
+
+    def _count_matrix(self, emails):
+        """Build a sparse (emails x vocab) count matrix plus the number of unseen words in each email"""
+        token_index = self.token_index
+        tokenize = get_metrics().timed('tokenize', self.tokenizer)
+        indptr = [0]
+        indices = []
+        unseen_counts = np.zeros(len(emails))
+        for row, email_content in enumerate(emails):
+            unseen = 0
+            for word in tokenize(email_content):
+                index = token_index.get(word)
+                if index is None:
+                    unseen += 1
+                else:
+                    indices.append(index)
+            unseen_counts[row] = unseen
+            indptr.append(len(indices))
+        # Repeated indices within a row are summed, giving term counts
+        data = np.ones(len(indices))
+        counts = csr_matrix((data, indices, indptr), shape=(len(emails), len(token_index)))
+        return counts, unseen_counts
+
+    def predict_proba_batch(self, emails):
+        """
+        Score many emails at once against the frozen log-probability tables, all classes in one sparse
+        matrix product. Returns an array of shape (n_emails, n_classes) with columns in the order of
+        `classes`, i.e. [spam_probability, ham_probability] by default.
+        """
+        if not self.is_fitted:
+            raise RuntimeError("Classifier is not fitted yet. Call fit() method before predicting.")
+        emails = list(emails)
+        metrics = get_metrics()
+        metrics.increment('emails_scored', len(emails))
+        with metrics.timer('score_batch'):
+            return self._predict_proba_batch(emails)
+
+    def _predict_proba_batch(self, emails):
+        counts, unseen_counts = self._count_matrix(emails)
+        log_probabilities = np.log(self.class_priors) + self._table_scores(counts) + np.outer(unseen_counts, self.unseen_log_prob)
+
+        # Normalize the probabilities the same way as classification_probability()
+        log_probabilities -= log_probabilities.max(axis=1, keepdims=True)
+        probabilities = np.exp(log_probabilities)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
+
+    def predict_batch(self, emails):
+        """Classify many emails at once, returning a list with the most probable class of each"""
+        probabilities = self.predict_proba_batch(emails)
+        return [self.classes[index] for index in probabilities.argmax(axis=1)]
+
+    def predict_labels_batch(self, emails, threshold=0.5):
+        """
+        Multi-label prediction: for each email, every class whose probability is at least `threshold`,
+        most probable first, and always at least the most probable class
+        """
+        labels = []
+        for probabilities in self.predict_proba_batch(emails):
+            order = np.argsort(-probabilities, kind='stable')
+            labels.append([self.classes[index] for index in order if index == order[0] or probabilities[index] >= threshold])
+        return labels
+
     def score(self, emails,labels):
         """Calculate the accuracy of the classifier on the given emails and labels"""
         if not self.is_fitted:
             raise RuntimeError("Classifier is not fitted yet. Call fit() method before scoring.")
-        
+
         if len(emails) != len(labels):
             raise ValueError("Number of emails and labels must be the same")
-        
+
         correct_predictions = 0
         for email, label in zip(emails, labels):
             predicted_label = self.classify(email)
             if predicted_label == label:
                 correct_predictions += 1
-        
+
         return correct_predictions / len(emails)
-        
-    def save_model(self, file_path):
-        """Save the trained model to a file"""
-        import pickle
-        with open(file_path, 'wb') as file:
-            pickle.dump(self, file)
-            
+
+    def _thaw(self):
+        """Copy the counts of a memory-mapped model into regular arrays and a dict so it can be trained further"""
+        if isinstance(self.vocab, MappedVocabulary):
+            self.vocab = {word: index for index, word in enumerate(self.vocab)}
+        if not self._word_count_buffer.flags.writeable:
+            self._word_count_buffer = self._word_count_buffer.copy()
+            self._document_frequency_buffer = self._document_frequency_buffer.copy()
+        if self._normalized_count_buffer is not None and not self._normalized_count_buffer.flags.writeable:
+            self._normalized_count_buffer = self._normalized_count_buffer.copy()
+
+    def save_model(self, file_path, legacy_pickle=False):
+        """
+        Save the trained model to a file. The default binary format can be memory-mapped by
+        load_model(); pass legacy_pickle=True to write the old whole-object pickle instead.
+        """
+        if legacy_pickle:
+            import pickle
+            self._thaw()
+            with open(file_path, 'wb') as file:
+                pickle.dump(self, file)
+            return
+
+        header = {
+            'classes': list(self.classes),
+            'laplace_smoothing_factor': self.laplace_smoothing_factor,
+            'tokenizer': self.tokenizer.get_config(),
+            'n_features': self.n_features,
+            'hash_seed': self.hash_seed,
+            'hash_function': self.hash_function,
+            'weighting': self.weighting,
+            'total_word_count': self.total_word_count.tolist(),
+            'email_count': self.email_count.tolist(),
+            'email_counts_known': self.email_counts_known,
+            'pruned_word_count': self.pruned_word_count.tolist(),
+            'pruned_normalized_count': self.pruned_normalized_count.tolist(),
+            'document_count': self.document_count,
+            'class_priors': self.class_priors.tolist(),
+            'vocab_size': self.vocab_size,
+            'is_fitted': self.is_fitted,
+            'unseen_log_prob': self.unseen_log_prob.tolist(),
+            'table_dtype': self.table_dtype,
+            'table_scales': self.table_scales.tolist(),
+        }
+        arrays = {
+            'word_counts': self.word_counts,
+            'log_prob': self.log_prob,
+        }
+        if self.weighting in IDF_WEIGHTINGS:
+            arrays['document_frequency'] = self.document_frequencies
+            arrays['idf'] = self.idf
+        if self._normalized_count_buffer is not None:
+            arrays['normalized_counts'] = self.normalized_counts
+        # The vocabulary is written in column order; hashing mode has none
+        write_model(file_path, header, list(self.vocab) if self.n_features is None else [], arrays)
+
+    @staticmethod
+    def load_model(file_path, allow_pickle=True):
+        """
+        Load a trained model from a file. Binary model files are memory-mapped, so load time does not
+        depend on vocabulary size and worker processes share one page-cached copy. Older pickled
+        models are still loaded when allow_pickle is True (only do this for files you trust).
+        """
+        with get_metrics().timer('model_load'):
+            if is_model_file(file_path):
+                return TFNaiveBayesClassifier._from_model_file(file_path)
+            if not allow_pickle:
+                raise ValueError(f"{file_path} is not a binary model file and pickle loading is disabled")
+            import pickle
+            with open(file_path, 'rb') as file:
+                return pickle.load(file)
+
+    @staticmethod
+    def _from_model_file(file_path):
+        """Build a classifier whose vocabulary, counts and scoring tables are views into a mapped model file"""
+        header, vocabulary, arrays = read_model(file_path)
+        if 'classes' not in header:
+            header, arrays = TFNaiveBayesClassifier._upgrade_two_class_file(header, arrays)
+        # Files written before the Tokenizer existed have no tokenizer config
+        tokenizer = Tokenizer.from_config(header['tokenizer']) if 'tokenizer' in header else _legacy_tokenizer()
+        classifier = TFNaiveBayesClassifier(header['laplace_smoothing_factor'], tokenizer,
+                                            header.get('n_features'), header.get('hash_seed', 0), header.get('weighting', 'tf'),
+                                            classes=header['classes'], hash_function=header.get('hash_function', 'crc32'))
+        for name in ('total_word_count', 'email_count', 'pruned_word_count', 'class_priors', 'unseen_log_prob', 'table_scales'):
+            setattr(classifier, name, np.array(header[name], dtype=getattr(classifier, name).dtype))
+        classifier.pruned_normalized_count = np.array(header.get('pruned_normalized_count', classifier.pruned_normalized_count))
+        classifier.document_count = header['document_count']
+        classifier.vocab_size = header['vocab_size']
+        classifier.is_fitted = header['is_fitted']
+        classifier.email_counts_known = header.get('email_counts_known', True)
+        classifier.table_dtype = header.get('table_dtype', 'float64')
+        if classifier.n_features is None:
+            classifier.vocab = vocabulary
+        classifier._word_count_buffer = arrays['word_counts']
+        classifier._document_frequency_buffer = arrays.get('document_frequency', np.zeros(arrays['word_counts'].shape[1], dtype=np.int64))
+        if 'normalized_counts' in arrays:
+            classifier._normalized_count_buffer = arrays['normalized_counts']
+        if 'idf' in arrays:
+            classifier.idf = arrays['idf']
+        classifier.log_prob = arrays['log_prob']
+        return classifier
+
     @staticmethod
-    def load_model(file_path):
-        """Load the trained model from a file"""
-        import pickle
-        with open(file_path, 'rb') as file:
-            return pickle.load(file)
\ No newline at end of file
+    def _upgrade_two_class_file(header, arrays):
+        """Map the header and arrays of a spam/ham-only model file onto the per-class layout (copies the tables)"""
+        header = dict(header, classes=list(DEFAULT_CLASSES))
+        for name, spam_name, ham_name in (('total_word_count', 'total_words_in_spam', 'total_words_in_ham'),
+                                          ('email_count', 'spam_email_count', 'ham_email_count'),
+                                          ('pruned_word_count', 'pruned_words_in_spam', 'pruned_words_in_ham'),
+                                          ('class_priors', 'p_spam', 'p_ham'),
+                                          ('unseen_log_prob', 'unseen_log_prob_spam', 'unseen_log_prob_ham')):
+            header[name] = [header.get(spam_name, 0), header.get(ham_name, 0)]
+        header['document_count'] = header['spam_email_count'] + header['ham_email_count']
+        scales = header.get('table_scales', {})
+        header['table_scales'] = [scales.get('spam', (1.0, 0.0)), scales.get('ham', (1.0, 0.0))]
+        arrays = dict(arrays,
+                      word_counts=np.vstack((arrays.pop('spam_counts'), arrays.pop('ham_counts'))),
+                      log_prob=np.vstack((arrays.pop('log_prob_spam'), arrays.pop('log_prob_ham'))))
+        return header, arrays
@@ -0,0 +1,224 @@
+import json
+import os
+import sqlite3
+import time
+import zlib
+from typing import Iterator, Optional
+
+from src.metrics import get_metrics
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DEFAULT_STORE_PATH = os.path.join(BASE_DIR, 'data', 'emails.sqlite')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    label TEXT NOT NULL,
+    subject TEXT,
+    sender TEXT,
+    date TEXT,
+    content TEXT,
+    fetched_at REAL
+);
+CREATE INDEX IF NOT EXISTS messages_label ON messages (label);
+CREATE TABLE IF NOT EXISTS tokens (
+    message_id TEXT NOT NULL,
+    tokenizer TEXT NOT NULL,
+    tokens TEXT NOT NULL,
+    PRIMARY KEY (message_id, tokenizer)
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _tokenizer_key(tokenizer) -> str:
+    return json.dumps(tokenizer.get_config(), sort_keys=True)
+
+
+def in_holdout(msg_id: str, holdout_percent: int) -> bool:
+    """Stable train/holdout split by message id, so a message stays on the same side across runs"""
+    return zlib.crc32(msg_id.encode('utf-8')) % 100 < holdout_percent
+
+
+class EmailStore:
+    """
+    Local SQLite store of labeled emails keyed by Gmail message id. Remembers the last synced
+    history id so later syncs only fetch new or changed messages, and caches tokenized emails
+    per tokenizer configuration so retraining skips both the network and re-tokenization.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.connection.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+    def __contains__(self, msg_id):
+        return self.connection.execute('SELECT 1 FROM messages WHERE id = ?', (msg_id,)).fetchone() is not None
+
+    def get_state(self, key: str) -> Optional[str]:
+        row = self.connection.execute('SELECT value FROM sync_state WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_state(self, key: str, value: str):
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)', (key, value))
+
+    def put(self, msg_id: str, label: str, details: dict, commit: bool = True):
+        """
+        Insert or replace a message. A stored message whose label and content are unchanged (e.g. it was only
+        marked read or starred) is updated in place, keeping its rowid and cached tokens, so models trained
+        on it stay valid; otherwise its cached tokens are dropped since the content may have changed.
+        """
+        content = details.get('content', '')
+        header = (details.get('subject', ''), details.get('sender', ''), details.get('date', ''))
+        stored = self.connection.execute('SELECT label, content FROM messages WHERE id = ?', (msg_id,)).fetchone()
+        if stored == (label, content):
+            self.connection.execute('UPDATE messages SET subject = ?, sender = ?, date = ?, fetched_at = ? WHERE id = ?',
+                                    (*header, time.time(), msg_id))
+        else:
+            # Replacing is a removal plus an insert, so the message moves to the end of the insertion order
+            self.delete(msg_id, commit=False)
+            self.connection.execute(
+                'INSERT INTO messages (id, label, subject, sender, date, content, fetched_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (msg_id, label, *header, content, time.time()))
+        if commit:
+            self.connection.commit()
+
+    def delete(self, msg_id: str, commit: bool = True):
+        if self.connection.execute('DELETE FROM messages WHERE id = ?', (msg_id,)).rowcount:
+            self.connection.execute(
+                "INSERT INTO sync_state (key, value) VALUES ('removed_messages', '1') "
+                "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+        self.connection.execute('DELETE FROM tokens WHERE message_id = ?', (msg_id,))
+        if commit:
+            self.connection.commit()
+
+    def removed_count(self) -> int:
+        """
+        How many stored messages have ever been deleted or replaced with a different label or content; a model
+        trained incrementally is stale once this changes
+        """
+        return int(self.get_state('removed_messages') or 0)
+
+    def iter_messages(self, label: Optional[str] = None) -> Iterator[tuple[str, str, dict]]:
+        """Streams (message id, label, details) in insertion order, optionally for one label only"""
+        query = 'SELECT id, label, subject, sender, date, content FROM messages'
+        params = ()
+        if label is not None:
+            query += ' WHERE label = ?'
+            params = (label,)
+        for msg_id, msg_label, subject, sender, date, content in self.connection.execute(query + ' ORDER BY rowid', params):
+            yield msg_id, msg_label, {'subject': subject, 'sender': sender, 'date': date, 'content': content}
+
+    def max_rowid(self) -> int:
+        """Position of the most recently stored message; messages stored later get larger rowids"""
+        return self.connection.execute('SELECT COALESCE(MAX(rowid), 0) FROM messages').fetchone()[0]
+
+    def iter_training_pairs(self, tokenizer=None, skip_empty: bool = True, chunk_size: int = 1000, after_rowid: int = 0,
+                            holdout_percent: int = 0, holdout: bool = False) -> Iterator[tuple]:
+        """
+        Streams (email, label) pairs for TFNaiveBayesClassifier.partial_fit(). With a tokenizer the email
+        is yielded as its token list, read from the cache or tokenized once and cached for the next run.
+        `after_rowid` skips messages stored before a previous training run (see max_rowid()). With a
+        holdout_percent, only the training side of the stable split is streamed, or the holdout side when
+        `holdout` is True.
+        """
+        where = ' WHERE m.rowid > ?' + (" AND m.content != ''" if skip_empty else '')
+
+        def selected(msg_id):
+            return not holdout_percent or in_holdout(msg_id, holdout_percent) == holdout
+
+        if tokenizer is None:
+            cursor = self.connection.execute(f'SELECT m.id, m.content, m.label FROM messages m{where} ORDER BY m.rowid', (after_rowid,))
+            for msg_id, content, label in cursor:
+                if selected(msg_id):
+                    yield content, label
+            return
+
+        key = _tokenizer_key(tokenizer)
+        metrics = get_metrics()
+        tokenize = metrics.timed('tokenize', tokenizer)
+        cursor = self.connection.execute(
+            f'SELECT m.id, m.content, m.label, t.tokens FROM messages m '
+            f'LEFT JOIN tokens t ON t.message_id = m.id AND t.tokenizer = ?{where} ORDER BY m.rowid', (key, after_rowid))
+        while rows := cursor.fetchmany(chunk_size):
+            rows = [row for row in rows if selected(row[0])]
+            new_tokens = []
+            for msg_id, content, label, cached in rows:
+                if cached is None:
+                    words = tokenize(content)
+                    new_tokens.append((msg_id, key, json.dumps(words)))
+                else:
+                    words = json.loads(cached)
+                yield words, label
+            metrics.increment('token_cache_misses', len(new_tokens))
+            metrics.increment('token_cache_hits', len(rows) - len(new_tokens))
+            if new_tokens:
+                self.connection.executemany('INSERT OR REPLACE INTO tokens (message_id, tokenizer, tokens) VALUES (?, ?, ?)', new_tokens)
+        self.connection.commit()
+
+    def sync(self, service, max_results_per_category: Optional[int] = None) -> dict:
+        """
+        Brings the store up to date with the mailbox. The first sync (or one whose history id has expired)
+        lists every spam/ham message and fetches only ids not already stored; later syncs replay the Gmail
+        history since the last synced history id and fetch just the added or relabeled messages.
+        Returns counts of stored and deleted messages.
+        """
+        from googleapiclient.errors import HttpError
+        from src.gmail_api import CATEGORY_QUERIES, get_history_id, iter_email_details, iter_history_changes, iter_message_ids, label_for
+
+        history_id = get_history_id(service)
+        last_history_id = self.get_state('last_history_id')
+        stats = {'stored': 0, 'deleted': 0}
+
+        def store(messages):
+            for msg_id, details in messages:
+                label = label_for(details.get('label_ids', [])) or details.get('label')
+                if label is None:
+                    self.delete(msg_id, commit=False)
+                    stats['deleted'] += 1
+                else:
+                    self.put(msg_id, label, details, commit=False)
+                    stats['stored'] += 1
+            self.connection.commit()
+
+        try:
+            if last_history_id is None:
+                raise LookupError('no previous sync')
+            changed = set()
+            for msg_id, deleted in iter_history_changes(service, last_history_id):
+                if deleted:
+                    self.delete(msg_id, commit=False)
+                    stats['deleted'] += 1
+                    changed.discard(msg_id)
+                else:
+                    changed.add(msg_id)
+            store(iter_email_details(service, sorted(changed)))
+        except (LookupError, HttpError) as error:
+            if isinstance(error, HttpError) and int(error.resp.status) != 404:
+                raise
+            # Full sync: list everything, but only download messages we have not stored yet
+            for label, query in CATEGORY_QUERIES.items():
+                msg_ids = (msg_id for msg_id in iter_message_ids(service, query=query, max_results=max_results_per_category) if msg_id not in self)
+                store((msg_id, dict(details, label=label)) for msg_id, details in iter_email_details(service, msg_ids))
+
+        self.set_state('last_history_id', str(history_id))
+        return stats
@@ -0,0 +1,68 @@
+import zlib
+from functools import lru_cache
+from hashlib import blake2b
+
+HASH_FUNCTIONS = ('blake2b', 'crc32')
+# Tokens whose bucket each FeatureHasher remembers, most recently used first
+BUCKET_CACHE_SIZE = 1 << 16
+
+
+class FeatureHasher:
+    """
+    Maps tokens to one of `n_features` buckets, standing in for a vocabulary so the classifier's memory
+    stays constant no matter how many distinct tokens it sees. Buckets come from blake2b keyed with the
+    seed, so each seed collides a different set of tokens. 'crc32' is the hash of earlier models, kept so
+    they still score the same; its seed only shifts every same-length token alike and separates nothing.
+    Both are stable across processes and Python versions, unlike hash(). Recently used tokens keep their
+    bucket in a cache. It exposes the same get()/len() interface as a token -> index dict, so the scoring
+    code works unchanged.
+    """
+
+    def __init__(self, n_features, seed=0, hash_function='blake2b'):
+        if n_features <= 0 or n_features & (n_features - 1):
+            raise ValueError("n_features must be a power of 2")
+        if hash_function not in HASH_FUNCTIONS:
+            raise ValueError(f"Hash function must be one of {HASH_FUNCTIONS}")
+        if hash_function == 'blake2b' and not 0 <= seed < 2 ** 64:
+            raise ValueError("Seed must be an integer in [0, 2**64)")
+        self.n_features = n_features
+        self.seed = seed
+        self.hash_function = hash_function
+        self._mask = n_features - 1
+        self._key = seed.to_bytes(8, 'little') if hash_function == 'blake2b' else None
+        bucket = self._blake2b_bucket if hash_function == 'blake2b' else self._crc32_bucket
+        self.get = lru_cache(maxsize=BUCKET_CACHE_SIZE)(bucket)
+
+    def _blake2b_bucket(self, word, default=None):
+        digest = blake2b(word.encode('utf-8'), digest_size=8, key=self._key).digest()
+        return int.from_bytes(digest, 'little') & self._mask
+
+    def _crc32_bucket(self, word, default=None):
+        return zlib.crc32(word.encode('utf-8'), self.seed) & self._mask
+
+    def __getstate__(self):
+        # The cache cannot be pickled; it is rebuilt empty
+        return {'n_features': self.n_features, 'seed': self.seed, 'hash_function': self.hash_function}
+
+    def __setstate__(self, state):
+        # Hashers pickled before the keyed hash existed used crc32
+        self.__init__(state['n_features'], state['seed'], state.get('hash_function', 'crc32'))
+
+    def __getitem__(self, word):
+        return self.get(word)
+
+    def __contains__(self, word):
+        return True
+
+    def __len__(self):
+        return self.n_features
+
+    def __iter__(self):
+        raise TypeError("A FeatureHasher has no vocabulary to iterate over")
+
+    def __eq__(self, other):
+        return (isinstance(other, FeatureHasher) and
+                (self.n_features, self.seed, self.hash_function) == (other.n_features, other.seed, other.hash_function))
+
+    def __hash__(self):
+        return hash((self.n_features, self.seed, self.hash_function))
@@ -1,12 +1,17 @@
 import os
-import base64
-from typing import Optional
+import time
+import random
+from itertools import islice
+from typing import Iterable, Iterator, Optional
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from src.metrics import get_metrics
+from src.mime_extract import extract_gmail_payload
+
 # If modifying these scopes, delete the file token.json.
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
@@ -39,70 +44,200 @@ def authenticate_gmail():
         print(f'An error occurred: {error}')
         return None
 
+# Gmail allows up to 100 calls per batch request but recommends 50 to stay under per-user rate limits
+BATCH_SIZE = 50
+MAX_PAGE_SIZE = 500
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+CATEGORY_QUERIES = {
+    'spam': 'label:SPAM',
+    'ham': 'category:primary -label:SPAM',
+}
+
+def _is_retryable(error) -> bool:
+    return isinstance(error, HttpError) and int(error.resp.status) in RETRYABLE_STATUS_CODES
+
+def _backoff_delay(backoff: float, attempt: int) -> float:
+    """Exponential backoff with jitter so parallel clients don't retry in lockstep"""
+    return backoff * (2 ** attempt) * (1 + random.random())
+
+def execute_with_retry(request, max_retries: int = 5, backoff: float = 1.0):
+    """Executes an API request, retrying with exponential backoff on 429 and 5xx responses."""
+    metrics = get_metrics()
+    for attempt in range(max_retries + 1):
+        try:
+            with metrics.timer('gmail_request'):
+                return request.execute()
+        except HttpError as error:
+            if not _is_retryable(error) or attempt == max_retries:
+                metrics.increment('gmail_request_errors')
+                raise
+            metrics.increment('gmail_request_retries')
+            time.sleep(_backoff_delay(backoff, attempt))
+
+def iter_message_ids(service, query='', max_results: Optional[int] = None, max_retries: int = 5, backoff: float = 1.0) -> Iterator[str]:
+    """Yields the ids of the user's messages that match the query, following nextPageToken across pages."""
+    page_token = None
+    remaining = max_results
+    while remaining is None or remaining > 0:
+        page_size = MAX_PAGE_SIZE if remaining is None else min(MAX_PAGE_SIZE, remaining)
+        request = service.users().messages().list(userId='me', q=query, maxResults=page_size, pageToken=page_token)
+        result = execute_with_retry(request, max_retries, backoff)
+        messages = result.get('messages', [])
+        for msg in messages:
+            yield msg['id']
+        if remaining is not None:
+            remaining -= len(messages)
+        page_token = result.get('nextPageToken')
+        if not page_token or not messages:
+            break
+
 def get_messages(service, query='', max_results=100) -> list[dict]:
     """Lists the user's messages that match the query."""
     try:
-        result = service.users().messages().list(userId='me', q=query, maxResults=max_results).execute()
-        return result.get('messages', [])
+        return [{'id': msg_id} for msg_id in iter_message_ids(service, query, max_results)]
     except HttpError as error:
         print(f'An error occurred while fetching messages: {error}')
         return []
 
+def parse_message(msg: dict) -> dict:
+    """
+    Extracts subject, sender, date, and content from a message resource fetched with format='full'.
+    The content is the text of the whole MIME tree: nested multiparts are walked, plain text is preferred
+    within multipart/alternative, and HTML-only messages are reduced to their visible text.
+    """
+    payload = msg.get('payload', {})
+    headers = payload.get('headers', [])
+
+    subject = next((d['value'] for d in headers if d['name'].lower() == 'subject'), '')
+    sender = next((d['value'] for d in headers if d['name'].lower() == 'from'), '')
+    date = next((d['value'] for d in headers if d['name'].lower() == 'date'), '')
+
+    body = extract_gmail_payload(payload)
+
+    return {'subject': subject, 'sender': sender, 'date': date, 'content': body,
+            'label_ids': msg.get('labelIds', []), 'history_id': msg.get('historyId')}
+
+def label_for(label_ids: list[str]) -> Optional[str]:
+    """Maps Gmail label ids to 'spam'/'ham' the same way CATEGORY_QUERIES selects messages (None if neither)."""
+    if 'SPAM' in label_ids:
+        return 'spam'
+    if 'CATEGORY_PERSONAL' in label_ids:
+        return 'ham'
+    return None
+
+def get_history_id(service, max_retries: int = 5, backoff: float = 1.0) -> str:
+    """Returns the mailbox's current history id, the starting point for the next incremental sync."""
+    return execute_with_retry(service.users().getProfile(userId='me'), max_retries, backoff)['historyId']
+
+def iter_history_changes(service, start_history_id: str, max_retries: int = 5, backoff: float = 1.0) -> Iterator[tuple[str, bool]]:
+    """
+    Yields (message id, deleted) for every message added, deleted or relabeled since `start_history_id`.
+    Raises HttpError 404 if the history id is too old, in which case a full sync is needed.
+    """
+    page_token = None
+    while True:
+        request = service.users().history().list(
+            userId='me', startHistoryId=start_history_id, pageToken=page_token,
+            historyTypes=['messageAdded', 'messageDeleted', 'labelAdded', 'labelRemoved'])
+        result = execute_with_retry(request, max_retries, backoff)
+        for record in result.get('history', []):
+            for change in record.get('messagesDeleted', []):
+                yield change['message']['id'], True
+            for key in ('messagesAdded', 'labelsAdded', 'labelsRemoved'):
+                for change in record.get(key, []):
+                    yield change['message']['id'], False
+        page_token = result.get('nextPageToken')
+        if not page_token:
+            break
+
 def get_email_details(service, msg_id) -> Optional[dict]:
     """
     Gets the full details of a single email in one API call.
     Returns a dictionary with subject, sender, date, and content.
     """
     try:
-        msg = service.users().messages().get(userId='me', id=msg_id, format='full').execute()
-        payload = msg.get('payload', {})
-        headers = payload.get('headers', [])
-        
-        subject = next((d['value'] for d in headers if d['name'].lower() == 'subject'), '')
-        sender = next((d['value'] for d in headers if d['name'].lower() == 'from'), '')
-        date = next((d['value'] for d in headers if d['name'].lower() == 'date'), '')
-        
-        body = ''
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain' and 'data' in part['body']:
-                    body += base64.urlsafe_b64decode(part['body']['data']).decode('utf-8', 'ignore')
-                    break # Stop after finding the first plain text part
-        elif 'data' in payload.get('body', {}):
-            body = base64.urlsafe_b64decode(payload['body']['data']).decode('utf-8', 'ignore')
-            
-        return {'subject': subject, 'sender': sender, 'date': date, 'content': body}
+        msg = execute_with_retry(service.users().messages().get(userId='me', id=msg_id, format='full'))
+        return parse_message(msg)
     except HttpError as error:
         print(f'An error occurred for message ID {msg_id}: {error}')
         return None
 
-def fetch_spam_and_ham(max_results_per_category: int) -> tuple[dict, dict]:
+def iter_email_details(service, msg_ids: Iterable[str], batch_size: int = BATCH_SIZE,
+                       max_retries: int = 5, backoff: float = 1.0) -> Iterator[tuple[str, dict]]:
+    """
+    Fetches messages through Gmail batch HTTP requests, `batch_size` messages per round trip.
+    Messages that fail with 429/5xx are retried with backoff; other failures are reported and skipped.
+    Yields (message id, parsed details) as each batch completes.
+    """
+    metrics = get_metrics()
+    ids = iter(msg_ids)
+    while chunk := list(islice(ids, batch_size)):
+        attempt = 0
+        while chunk:
+            responses = {}
+            retry = []
+
+            def callback(request_id, response, exception):
+                if exception is None:
+                    responses[request_id] = response
+                elif _is_retryable(exception) and attempt < max_retries:
+                    retry.append(request_id)
+                else:
+                    metrics.increment('gmail_message_errors')
+                    print(f'An error occurred for message ID {request_id}: {exception}')
+
+            batch = service.new_batch_http_request(callback=callback)
+            for msg_id in chunk:
+                batch.add(service.users().messages().get(userId='me', id=msg_id, format='full'), request_id=msg_id)
+            execute_with_retry(batch, max_retries, backoff)
+
+            metrics.increment('gmail_messages_fetched', len(responses))
+            for msg_id in chunk:
+                if msg_id in responses:
+                    yield msg_id, parse_message(responses[msg_id])
+            if retry:
+                metrics.increment('gmail_message_retries', len(retry))
+                time.sleep(_backoff_delay(backoff, attempt))
+                attempt += 1
+            chunk = retry
+
+def stream_spam_and_ham(service, max_results_per_category: Optional[int] = None, batch_size: int = BATCH_SIZE,
+                        stats: Optional[dict] = None) -> Iterator[tuple[str, str, dict]]:
+    """
+    Streams (label, message id, details) for spam and ham messages without holding them all in memory.
+    If a `stats` dict is given it is kept updated with the message count, elapsed seconds and messages/sec.
+    """
+    stats = stats if stats is not None else {}
+    stats.update(messages=0, seconds=0.0, messages_per_second=0.0)
+    start = time.perf_counter()
+    for label, query in CATEGORY_QUERIES.items():
+        msg_ids = iter_message_ids(service, query=query, max_results=max_results_per_category)
+        for msg_id, details in iter_email_details(service, msg_ids, batch_size=batch_size):
+            stats['messages'] += 1
+            stats['seconds'] = time.perf_counter() - start
+            stats['messages_per_second'] = stats['messages'] / stats['seconds'] if stats['seconds'] else 0.0
+            yield label, msg_id, details
+
+def fetch_spam_and_ham(max_results_per_category: int, service=None) -> tuple[dict, dict]:
     """
     Main function to authenticate, fetch, and process spam and ham emails.
     Returns two dictionaries: one for spam and one for ham.
     """
-    service = authenticate_gmail()
+    service = service or authenticate_gmail()
     if not service:
         return {}, {}
 
-    spam_messages = get_messages(service, query='label:SPAM', max_results=max_results_per_category)
-    ham_messages = get_messages(service, query='category:primary -label:SPAM', max_results=max_results_per_category)
-    
-    print(f"Found {len(spam_messages)} spam messages and {len(ham_messages)} ham messages.")
-    
-    spam_content = {}
-    for msg in spam_messages:
-        details = get_email_details(service, msg['id'])
-        if details:
-            spam_content[msg['id']] = details
-            
-    ham_content = {}
-    for msg in ham_messages:
-        details = get_email_details(service, msg['id'])
-        if details:
-            ham_content[msg['id']] = details
-            
-    return spam_content, ham_content
+    content = {'spam': {}, 'ham': {}}
+    stats = {}
+    try:
+        for label, msg_id, details in stream_spam_and_ham(service, max_results_per_category, stats=stats):
+            content[label][msg_id] = details
+    except HttpError as error:
+        print(f'An error occurred while fetching messages: {error}')
+
+    print(f"Fetched {len(content['spam'])} spam messages and {len(content['ham'])} ham messages "
+          f"({stats.get('messages_per_second', 0.0):.1f} messages/sec).")
+    return content['spam'], content['ham']
 
 # if __name__ == '__main__':
 #     # This block runs if you execute this script directly (e.g., `python gmail_api.py`)
@@ -0,0 +1,51 @@
+import numpy as np
+
+MULTI_LABEL_TYPES = (list, tuple, set, frozenset)
+
+
+class LabelEncoder:
+    """
+    Maps class labels to the row indices of the classifier's count and probability tables. The classes
+    are fixed up front, so streaming training can validate every label as it arrives instead of silently
+    dropping ones it does not know. An email labelled with a list, tuple or set of classes is multi-label.
+    """
+
+    def __init__(self, classes):
+        # NumPy scalars (e.g. labels taken from an array) are stored as plain Python values so they serialize
+        classes = tuple(label.item() if isinstance(label, np.generic) else label for label in classes)
+        if len(classes) < 2:
+            raise ValueError("At least two classes are needed")
+        if len(set(classes)) != len(classes):
+            raise ValueError("Classes must be unique")
+        if any(isinstance(label, MULTI_LABEL_TYPES) for label in classes):
+            raise ValueError("A class label cannot be a list, tuple or set")
+        self.classes = classes
+        self._index = {label: index for index, label in enumerate(classes)}
+
+    def index(self, label):
+        """Row index of a single class label"""
+        try:
+            return self._index[label]
+        except (KeyError, TypeError):
+            raise ValueError(f"Unknown label {label!r}, expected one of {self.classes}") from None
+
+    def encode(self, label):
+        """Row indices of an email's label, or of each of its labels when given a list, tuple or set"""
+        if not isinstance(label, MULTI_LABEL_TYPES):
+            return (self.index(label),)
+        rows = tuple(sorted({self.index(single_label) for single_label in label}))
+        if not rows:
+            raise ValueError("A multi-label email needs at least one label")
+        return rows
+
+    def decode(self, index):
+        return self.classes[index]
+
+    def __len__(self):
+        return len(self.classes)
+
+    def __eq__(self, other):
+        return isinstance(other, LabelEncoder) and self.classes == other.classes
+
+    def __hash__(self):
+        return hash(self.classes)
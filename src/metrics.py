@@ -0,0 +1,142 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+# Hot paths call into whichever metrics object is installed here. The default NullMetrics does
+# nothing, and call sites wrap per-email functions only when metrics.enabled, so uninstrumented
+# runs pay a single attribute check per batch rather than a timer per email.
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class NullMetrics:
+    """Metrics sink that discards everything; installed by default"""
+    enabled = False
+
+    def timer(self, name):
+        return _NULL_TIMER
+
+    def timed(self, name, func):
+        return func
+
+    def observe(self, name, seconds):
+        pass
+
+    def increment(self, name, value=1):
+        pass
+
+
+class Metrics:
+    """
+    In-process timers and counters. A timer keeps the number of observations, their total and the
+    largest one, in seconds. Safe to update from several threads.
+    """
+    enabled = True
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def timed(self, name, func):
+        """Wrap func so every call is observed under `name`"""
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.observe(name, time.perf_counter() - start)
+        return wrapper
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                self.timers[name] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                timer[2] = max(timer[2], seconds)
+
+    def increment(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def snapshot(self):
+        """Plain dict of every timer and counter, as written by to_json()"""
+        with self._lock:
+            return {
+                'timers': {name: {'count': count, 'total_seconds': total, 'max_seconds': largest}
+                           for name, (count, total, largest) in sorted(self.timers.items())},
+                'counters': dict(sorted(self.counters.items())),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self, prefix='naive_bayes'):
+        """Prometheus text exposition format: timers as summaries (plus a _max gauge), counters as counters"""
+        snapshot = self.snapshot()
+        lines = []
+        for name, timer in snapshot['timers'].items():
+            metric = f'{prefix}_{name}_seconds'
+            lines += [f'# TYPE {metric} summary',
+                      f'{metric}_count {timer["count"]}',
+                      f'{metric}_sum {timer["total_seconds"]!r}',
+                      f'# TYPE {metric}_max gauge',
+                      f'{metric}_max {timer["max_seconds"]!r}']
+        for name, value in snapshot['counters'].items():
+            metric = f'{prefix}_{name}_total'
+            lines += [f'# TYPE {metric} counter', f'{metric} {value}']
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Export to a file, in Prometheus text format if it ends in .prom and as JSON otherwise"""
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+
+
+_metrics = NullMetrics()
+
+
+def get_metrics():
+    return _metrics
+
+
+def set_metrics(metrics):
+    """Install a metrics object (Metrics, NullMetrics or anything with the same methods); returns the previous one"""
+    global _metrics
+    previous, _metrics = _metrics, metrics
+    return previous
+
+
+def enable_metrics():
+    """Start collecting into a fresh Metrics object, unless one is already installed, and return it"""
+    if not _metrics.enabled:
+        set_metrics(Metrics())
+    return _metrics
@@ -0,0 +1,313 @@
+import base64
+import binascii
+import html
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email.header import decode_header, make_header
+from itertools import islice
+from typing import Iterable, Iterator, Optional
+
+# Deeper MIME trees than this are almost certainly malicious; their inner parts are ignored
+MAX_DEPTH = 20
+
+_BLANK_LINE = re.compile(rb'\r?\n\r?\n')
+_FOLDED_LINE = re.compile(rb'\r?\n[ \t]+')
+_NON_BASE64 = re.compile(rb'[^A-Za-z0-9+/]')
+_PARAMETER = re.compile(r';\s*([\w\-*]+)\s*=\s*(?:"((?:[^"\\]|\\.)*)"|([^;\s]*))')
+
+# HTML is stripped with a few regular expressions rather than a parser: invisible blocks are dropped,
+# block-level tags become line breaks and all other tags disappear without a space, so words split
+# by inline tags (a common spam trick, fr<b></b>ee) come back together.
+_HTML_INVISIBLE = re.compile(r'<(script|style|head)\b.*?</\1\s*>|<!--.*?-->', re.IGNORECASE | re.DOTALL)
+_HTML_BLOCK = re.compile(r'</?(?:br|p|div|tr|td|th|li|ul|ol|table|h[1-6]|blockquote|hr)\b[^>]*>', re.IGNORECASE)
+_HTML_TAG = re.compile(r'<[^>]*>')
+_SPACES = re.compile(r'[ \t\f\v\r\xa0]+')
+_LINE_BREAKS = re.compile(r' ?\n\s*')
+
+
+def html_to_text(markup: str) -> str:
+    """Visible text of an HTML document, one line per block element"""
+    text = _HTML_INVISIBLE.sub(' ', markup)
+    text = _HTML_BLOCK.sub('\n', text)
+    text = html.unescape(_HTML_TAG.sub('', text))
+    return _LINE_BREAKS.sub('\n', _SPACES.sub(' ', text)).strip()
+
+
+def _decode(raw, charset: Optional[str]) -> str:
+    charset = (charset or '').strip().lower()
+    # Undeclared or us-ascii text is often really UTF-8 or Latin-1; UTF-8 decodes ASCII identically
+    if charset in ('', 'us-ascii', 'ascii'):
+        charset = 'utf-8'
+    try:
+        return str(raw, charset, 'replace')
+    except LookupError:
+        return str(raw, 'utf-8', 'replace')
+
+
+def _parse_content_type(value: str) -> tuple[str, dict]:
+    content_type, _, parameters = value.partition(';')
+    params = {}
+    for name, quoted, plain in _PARAMETER.findall(';' + parameters):
+        params[name.lower()] = quoted.replace('\\"', '"') if quoted else plain
+    return content_type.strip().lower() or 'text/plain', params
+
+
+def _decode_header_value(value: str) -> str:
+    """Decode RFC 2047 encoded words such as =?utf-8?b?...?="""
+    if '=?' not in value:
+        return value
+    try:
+        return str(make_header(decode_header(value)))
+    except (LookupError, ValueError, UnicodeError):
+        return value
+
+
+class _Part:
+    """
+    Common view of one node of a MIME tree, whether from a raw message or a Gmail API payload, so both
+    are walked by the same rules in _extract()
+    """
+    content_type = 'text/plain'
+    params = {}
+    is_attachment = False
+
+    def children(self):
+        return []
+
+    def text(self) -> str:
+        return ''
+
+
+class _RawPart(_Part):
+    """
+    A part of a raw RFC 822 message, as offsets into the message buffer (bytes or an mmap). Boundaries are
+    found with find() on the buffer and bodies are decoded from memoryview slices, so no part is copied
+    before its decoded text is produced.
+    """
+
+    def __init__(self, data, start: int, end: int, default_type: str = 'text/plain'):
+        self.data = data
+        blank_line = _BLANK_LINE.search(data, start, end)
+        if data[start:start + 1] == b'\n' or data[start:start + 2] == b'\r\n':
+            # No headers at all
+            header_end, self.body_start = start, start + (1 if data[start:start + 1] == b'\n' else 2)
+        elif blank_line is None:
+            header_end, self.body_start = end, end
+        else:
+            header_end, self.body_start = blank_line.start(), blank_line.end()
+        self.body_end = end
+        self.headers = self._parse_headers(data[start:header_end])
+        self.content_type, self.params = _parse_content_type(self.headers.get('content-type', default_type))
+        self.is_attachment = self.headers.get('content-disposition', '').lower().startswith('attachment')
+
+    @staticmethod
+    def _parse_headers(block: bytes) -> dict:
+        """First value of each header, keyed by lowercased name"""
+        headers = {}
+        for line in _FOLDED_LINE.sub(b' ', block).splitlines():
+            name, colon, value = line.partition(b':')
+            if colon:
+                headers.setdefault(name.strip().lower().decode('ascii', 'replace'), value.strip().decode('utf-8', 'replace'))
+        return headers
+
+    def children(self):
+        if self.content_type.startswith('message/'):
+            return [_RawPart(self.data, self.body_start, self.body_end)]
+        boundary = self.params.get('boundary')
+        if not boundary:
+            return []
+        data, end = self.data, self.body_end
+        # Digest parts default to message/rfc822 rather than text/plain
+        default_type = 'message/rfc822' if self.content_type == 'multipart/digest' else 'text/plain'
+        delimiter = b'--' + boundary.encode('ascii', 'replace')
+        if data[self.body_start:self.body_start + len(delimiter)] == delimiter:
+            position = self.body_start
+        else:
+            position = data.find(b'\n' + delimiter, self.body_start, end)
+            if position < 0:
+                return []
+            position += 1
+        parts = []
+        while True:
+            after = position + len(delimiter)
+            if data[after:after + 2] == b'--':
+                break
+            part_start = data.find(b'\n', after, end) + 1
+            if part_start <= 0:
+                break
+            following = data.find(b'\n' + delimiter, part_start, end)
+            part_end = end if following < 0 else following
+            if part_end > part_start and data[part_end - 1:part_end] == b'\r':
+                part_end -= 1
+            parts.append(_RawPart(data, part_start, part_end, default_type))
+            if following < 0:
+                break
+            position = following + 1
+        return parts
+
+    def text(self) -> str:
+        encoding = self.headers.get('content-transfer-encoding', '').strip().lower()
+        with memoryview(self.data) as view:
+            body = view[self.body_start:self.body_end]
+            if encoding == 'base64':
+                try:
+                    raw = binascii.a2b_base64(body)
+                except binascii.Error:
+                    # A truncated message ends mid-quantum; decode the complete quanta
+                    encoded = _NON_BASE64.sub(b'', body)
+                    raw = binascii.a2b_base64(encoded[:len(encoded) // 4 * 4])
+            elif encoding == 'quoted-printable':
+                raw = binascii.a2b_qp(body)
+            else:
+                raw = body
+            try:
+                return _decode(raw, self.params.get('charset'))
+            finally:
+                body.release()
+
+
+class _GmailPart(_Part):
+    """A part of a Gmail API message payload (format='full'), whose body data is already transfer-decoded"""
+
+    def __init__(self, payload: dict):
+        self.payload = payload
+        headers = {header['name'].lower(): header['value'] for header in payload.get('headers', [])}
+        self.content_type, self.params = _parse_content_type(headers.get('content-type', payload.get('mimeType', 'text/plain')))
+        self.is_attachment = bool(payload.get('filename')) or headers.get('content-disposition', '').lower().startswith('attachment')
+
+    def children(self):
+        return [_GmailPart(part) for part in self.payload.get('parts', [])]
+
+    def text(self) -> str:
+        # Large bodies are only referenced by attachmentId and would need another request
+        data = self.payload.get('body', {}).get('data')
+        if not data:
+            return ''
+        return _decode(base64.urlsafe_b64decode(data + '=' * (-len(data) % 4)), self.params.get('charset'))
+
+
+def _alternative_rank(part: _Part) -> int:
+    """Order in which the versions of a multipart/alternative are tried: plain text, nested multiparts, HTML"""
+    if part.content_type == 'text/plain':
+        return 0
+    if part.content_type.startswith('multipart/'):
+        return 1
+    return 2 if part.content_type == 'text/html' else 3
+
+
+def _extract(part: _Part, depth: int = 0) -> str:
+    """Readable text of a MIME (sub)tree; attachments and non-text leaves contribute nothing"""
+    if depth > MAX_DEPTH or part.is_attachment:
+        return ''
+    content_type = part.content_type
+    if content_type == 'multipart/alternative':
+        for child in sorted(part.children(), key=_alternative_rank):
+            text = _extract(child, depth + 1)
+            if text.strip():
+                return text
+        return ''
+    if content_type.startswith(('multipart/', 'message/')):
+        return '\n'.join(filter(None, (_extract(child, depth + 1) for child in part.children())))
+    if content_type == 'text/plain':
+        return part.text()
+    if content_type == 'text/html':
+        return html_to_text(part.text())
+    return ''
+
+
+def extract_gmail_payload(payload: dict) -> str:
+    """Body text of a Gmail API message payload, walking nested multiparts and falling back to stripped HTML"""
+    return _extract(_GmailPart(payload))
+
+
+def _extract_raw(data, start: int, end: int) -> dict:
+    message = _RawPart(data, start, end)
+    headers = message.headers
+    return {
+        'subject': _decode_header_value(headers.get('subject', '')),
+        'sender': _decode_header_value(headers.get('from', '')),
+        'date': headers.get('date', ''),
+        'message_id': headers.get('message-id', ''),
+        'content': _extract(message),
+    }
+
+
+def extract_message(raw: bytes) -> dict:
+    """Parse a raw RFC 822 message into subject, sender, date, message_id and body text, like parse_message()"""
+    return _extract_raw(raw, 0, len(raw))
+
+
+def _iter_mbox_spans(mapped) -> Iterator[tuple[int, int]]:
+    """(start, end) offsets of each message in an mbox, excluding its 'From ' separator line"""
+    position = 0 if mapped[:5] == b'From ' else mapped.find(b'\nFrom ')
+    while position >= 0:
+        if mapped[position:position + 1] == b'\n':
+            position += 1
+        start = mapped.find(b'\n', position) + 1
+        if start <= 0:
+            return
+        following = mapped.find(b'\nFrom ', start)
+        yield start, (len(mapped) if following < 0 else following)
+        position = following
+
+
+def _map_file(path: str):
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return None
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_mbox(path: str) -> Iterator[bytes]:
+    """Stream the raw messages of an mbox file from a memory map"""
+    mapped = _map_file(path)
+    if mapped is None:
+        return
+    with mapped:
+        for start, end in _iter_mbox_spans(mapped):
+            yield mapped[start:end]
+
+
+def _extract_batch(raw_messages: list) -> list:
+    return [extract_message(raw) for raw in raw_messages]
+
+
+def extract_messages(raw_messages: Iterable[bytes], n_jobs: int = 1, chunk_size: int = 64) -> Iterator[dict]:
+    """
+    Extract many raw messages, in order. With n_jobs > 1 (-1 for every CPU) chunks of `chunk_size`
+    messages are parsed in worker processes, with only a couple of chunks per worker in flight so
+    arbitrarily large inputs stream in bounded memory.
+    """
+    if n_jobs == -1:
+        n_jobs = os.cpu_count() or 1
+    if n_jobs <= 1:
+        yield from map(extract_message, raw_messages)
+        return
+    messages = iter(raw_messages)
+    chunks = iter(lambda: list(islice(messages, chunk_size)), [])
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        pending = deque(executor.submit(_extract_batch, chunk) for chunk in islice(chunks, 2 * n_jobs))
+        while pending:
+            results = pending.popleft().result()
+            for chunk in islice(chunks, 1):
+                pending.append(executor.submit(_extract_batch, chunk))
+            yield from results
+
+
+def extract_mbox(path: str, n_jobs: int = 1, chunk_size: int = 64) -> Iterator[dict]:
+    """
+    Extract every message of an mbox file. In a single process messages are parsed straight from the
+    memory-mapped file; with n_jobs > 1 each message is copied once to be sent to a worker.
+    """
+    if n_jobs != 1:
+        yield from extract_messages(iter_mbox(path), n_jobs, chunk_size)
+        return
+    mapped = _map_file(path)
+    if mapped is None:
+        return
+    with mapped:
+        for start, end in _iter_mbox_spans(mapped):
+            yield _extract_raw(mapped, start, end)
@@ -0,0 +1,193 @@
+import json
+import mmap
+import struct
+import zlib
+from collections.abc import Mapping
+from functools import lru_cache
+
+import numpy as np
+
+# File layout (all integers little endian):
+#   magic (8 bytes) | format version (uint32) | header length (uint32) | JSON header | padding
+#   followed by 8-byte aligned array sections described in header['sections'].
+# The vocabulary is stored as one UTF-8 blob plus an offsets array, with an open-addressing
+# hash table (crc32, linear probing) so lookups work straight from the mapped file.
+MAGIC = b'NBTFMDL\x00'
+FORMAT_VERSION = 2
+_PREAMBLE = struct.Struct('<8sII')
+_ALIGNMENT = 8
+# Tokens whose lookup result each MappedVocabulary remembers, most recently used first
+LOOKUP_CACHE_SIZE = 1 << 16
+
+
+def _align(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _hash_token(key):
+    return zlib.crc32(key)
+
+
+def _build_hash_table(encoded_tokens):
+    """Build the open-addressing slot table mapping crc32(token) -> token index"""
+    n_slots = 8
+    while n_slots < 2 * len(encoded_tokens):
+        n_slots *= 2
+    mask = n_slots - 1
+    slots = np.full(n_slots, -1, dtype=np.int64)
+    for index, key in enumerate(encoded_tokens):
+        slot = _hash_token(key) & mask
+        while slots[slot] >= 0:
+            slot = (slot + 1) & mask
+        slots[slot] = index
+    return slots
+
+
+class MappedVocabulary:
+    """
+    Read-only token -> index lookup backed by the vocabulary sections of a mapped model file. Probing the
+    mapped table runs in Python, so the results for the `cache_size` most recently used tokens, found or
+    not, are kept in an LRU cache: frequent tokens resolve at dict speed while the process never holds
+    more than a bounded slice of the vocabulary.
+    """
+
+    def __init__(self, blob, offsets, slots, cache_size=LOOKUP_CACHE_SIZE):
+        # memoryviews index to plain Python ints, which is much cheaper than NumPy scalars
+        self._blob = memoryview(blob)
+        self._offsets = memoryview(offsets)
+        self._slots = memoryview(slots)
+        self._mask = len(slots) - 1
+        # get() is the cached probe itself, so a cache hit costs no Python-level call
+        self.get = lru_cache(maxsize=cache_size)(self._probe)
+
+    def _probe(self, word, default=None):
+        """Index of the token in the mapped table, or `default`"""
+        key = word.encode('utf-8')
+        slots, offsets, blob = self._slots, self._offsets, self._blob
+        slot = _hash_token(key) & self._mask
+        while True:
+            index = slots[slot]
+            if index < 0:
+                return default
+            if blob[offsets[index]:offsets[index + 1]] == key:
+                return index
+            slot = (slot + 1) & self._mask
+
+    def __getitem__(self, word):
+        index = self.get(word)
+        if index is None:
+            raise KeyError(word)
+        return index
+
+    def __contains__(self, word):
+        return self.get(word) is not None
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __iter__(self):
+        """Yield tokens in index order"""
+        blob, offsets = self._blob, self._offsets
+        for index in range(len(self)):
+            yield bytes(blob[offsets[index]:offsets[index + 1]]).decode('utf-8')
+
+
+class MappedCounts(Mapping):
+    """
+    Read-only word -> count view over a count array indexed by a vocabulary (a MappedVocabulary, or a
+    FeatureHasher in hashing mode), usable wherever a Counter is read
+    """
+
+    def __init__(self, vocabulary, counts):
+        self._vocabulary = vocabulary
+        self._counts = counts
+
+    def get(self, word, default=0):
+        index = self._vocabulary.get(word)
+        if index is None:
+            return default
+        return int(self._counts[index])
+
+    def __getitem__(self, word):
+        return self.get(word, 0)
+
+    def __contains__(self, word):
+        index = self._vocabulary.get(word)
+        return index is not None and self._counts[index] > 0
+
+    def __iter__(self):
+        """Yield every word with a non-zero count"""
+        counts = self._counts
+        for index, word in enumerate(self._vocabulary):
+            if counts[index]:
+                yield word
+
+    def __len__(self):
+        return int(np.count_nonzero(self._counts))
+
+
+def is_model_file(file_path):
+    """Check whether the file starts with the binary model magic bytes"""
+    with open(file_path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def write_model(file_path, header, vocabulary, arrays):
+    """
+    Write a model file. `vocabulary` is the list of tokens in index order and `arrays`
+    maps section names to NumPy arrays aligned with it (counts, log-probabilities, ...).
+    """
+    encoded_tokens = [word.encode('utf-8') for word in vocabulary]
+    offsets = np.zeros(len(encoded_tokens) + 1, dtype=np.uint64)
+    np.cumsum([len(key) for key in encoded_tokens], out=offsets[1:])
+    sections = {
+        'vocab_offsets': offsets,
+        'vocab_blob': np.frombuffer(b''.join(encoded_tokens), dtype=np.uint8),
+        'vocab_slots': _build_hash_table(encoded_tokens),
+    }
+    sections.update((name, np.ascontiguousarray(array)) for name, array in arrays.items())
+
+    # Section offsets are relative to the start of the data area
+    layout = {}
+    offset = 0
+    for name, array in sections.items():
+        offset = _align(offset)
+        layout[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+        offset += array.nbytes
+    header = dict(header, n_tokens=len(encoded_tokens), sections=layout)
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_start = _align(_PREAMBLE.size + len(header_bytes))
+
+    with open(file_path, 'wb') as file:
+        file.write(_PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header_bytes)))
+        file.write(header_bytes)
+        for name, array in sections.items():
+            file.write(b'\x00' * (data_start + layout[name]['offset'] - file.tell()))
+            file.write(array.tobytes())
+
+
+def read_model(file_path):
+    """
+    Memory-map a model file. Returns (header, vocabulary, arrays) where the arrays are
+    read-only views into the page cache, so every process loading the file shares one copy.
+    """
+    with open(file_path, 'rb') as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    magic, version, header_length = _PREAMBLE.unpack_from(mapped, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{file_path} is not a Naive Bayes model file")
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Unsupported model format version {version} (latest supported is {FORMAT_VERSION})")
+    header = json.loads(mapped[_PREAMBLE.size:_PREAMBLE.size + header_length].decode('utf-8'))
+    data_start = _align(_PREAMBLE.size + header_length)
+
+    arrays = {}
+    for name, section in header.pop('sections').items():
+        dtype = np.dtype(section['dtype'])
+        count = int(np.prod(section['shape']))
+        array = np.frombuffer(mapped, dtype=dtype, count=count, offset=data_start + section['offset'])
+        arrays[name] = array.reshape(section['shape'])
+
+    vocabulary = MappedVocabulary(arrays.pop('vocab_blob'), arrays.pop('vocab_offsets'), arrays.pop('vocab_slots'))
+    return header, vocabulary, arrays
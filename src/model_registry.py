@@ -0,0 +1,124 @@
+import datetime
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+CURRENT_FILE = 'CURRENT'
+MODEL_PREFIX = 'TF_NaiveBayes_Classifier_'
+MODEL_SUFFIX = '.nbm'
+METADATA_SUFFIX = '.json'
+
+
+def _write_atomic(path: str, write):
+    """Write a file through a temporary file in the same directory and rename it into place"""
+    descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    os.close(descriptor)
+    try:
+        write(temp_path)
+        with open(temp_path, 'rb+') as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ModelRegistry:
+    """
+    Directory of published model versions plus a CURRENT file naming the one to serve. Models and their
+    JSON metadata are written under a temporary name and renamed into place, and CURRENT is switched the
+    same way, so readers only ever see complete files. Each version gets a new file name, so a process
+    still serving a memory-mapped older version is never affected by a publish.
+    """
+
+    def __init__(self, models_dir: str):
+        self.models_dir = models_dir
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.models_dir, name)
+
+    def current_path(self) -> Optional[str]:
+        """Path of the model CURRENT points to, or None if nothing has been published"""
+        try:
+            with open(self._path(CURRENT_FILE), encoding='utf-8') as file:
+                name = file.read().strip()
+        except FileNotFoundError:
+            return None
+        path = self._path(name)
+        return path if name and os.path.exists(path) else None
+
+    def versions(self) -> list[str]:
+        """Paths of every published model, oldest first"""
+        if not os.path.isdir(self.models_dir):
+            return []
+        names = sorted(name for name in os.listdir(self.models_dir) if name.startswith(MODEL_PREFIX) and name.endswith(MODEL_SUFFIX))
+        return [self._path(name) for name in names]
+
+    def metadata(self, model_path: str) -> dict:
+        """Metadata recorded when the model was published ({} for models written by other means)"""
+        try:
+            with open(model_path + METADATA_SUFFIX, encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+
+    def publish(self, classifier, metadata: Optional[dict] = None) -> str:
+        """Save the classifier as a new version, then point CURRENT at it. Returns the model path."""
+        os.makedirs(self.models_dir, exist_ok=True)
+        stem = MODEL_PREFIX + datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        name, attempt = stem + MODEL_SUFFIX, 0
+        while os.path.exists(self._path(name)):
+            attempt += 1
+            name = f'{stem}_{attempt}{MODEL_SUFFIX}'
+        path = self._path(name)
+
+        metadata = dict(metadata or {}, published_at=time.time())
+        # Metadata goes first so a visible model always has its metadata
+        _write_atomic(path + METADATA_SUFFIX, lambda temp_path: self._dump_json(metadata, temp_path))
+        _write_atomic(path, classifier.save_model)
+        self.set_current(path)
+        return path
+
+    @staticmethod
+    def _dump_json(data, path):
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump(data, file, indent=2)
+
+    def set_current(self, model_path: str):
+        """Atomically point CURRENT at a model in this directory, e.g. to roll back to an older version"""
+        name = os.path.basename(model_path)
+        if not os.path.exists(self._path(name)):
+            raise FileNotFoundError(f"{name} is not in {self.models_dir}")
+
+        def write(temp_path):
+            with open(temp_path, 'w', encoding='utf-8') as file:
+                file.write(name + '\n')
+        _write_atomic(self._path(CURRENT_FILE), write)
+
+    def prune(self, keep: int = 5, max_age_days: Optional[float] = None) -> list[str]:
+        """
+        Delete old versions, keeping the newest `keep` and, with max_age_days, only those younger than that.
+        The current version is never deleted. Returns the paths removed.
+        """
+        if keep < 1:
+            raise ValueError("At least one version must be kept")
+        current = self.current_path()
+        versions = self.versions()
+        removed = []
+        for index, path in enumerate(versions):
+            newest = index >= len(versions) - keep
+            young = max_age_days is None or time.time() - os.path.getmtime(path) < max_age_days * 86400
+            if path == current or (newest and young):
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                # e.g. still mapped by a server on Windows; try again on the next prune
+                continue
+            if os.path.exists(path + METADATA_SUFFIX):
+                os.remove(path + METADATA_SUFFIX)
+            removed.append(path)
+        return removed
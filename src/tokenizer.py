@@ -0,0 +1,95 @@
+import sys
+
+# Punctuation stripped from both ends of every word, as the classifier has always done in fit()
+DEFAULT_STRIP_CHARS = '.,!?;:"()[]}{'
+CASE_FOLDING_MODES = ('casefold', 'lower', None)
+
+
+class Tokenizer:
+    """
+    Turns email text into tokens. The same instance is used by the classifier for training and for
+    classification, so both always see identical tokens.
+
+    The pipeline is compiled once in __init__ into a single list comprehension: the text is
+    case-folded in one call, split once, and each word is stripped and filtered in the same pass.
+    """
+
+    def __init__(self, strip_chars=DEFAULT_STRIP_CHARS, case_folding='casefold', ngram_range=(1, 1),
+                 stop_words=None, min_length=1, max_length=None):
+        if case_folding not in CASE_FOLDING_MODES:
+            raise ValueError(f"case_folding must be one of {CASE_FOLDING_MODES}")
+        min_n, max_n = ngram_range
+        if min_n < 1 or max_n < min_n:
+            raise ValueError("ngram_range must satisfy 1 <= min_n <= max_n")
+        if min_length < 0 or (max_length is not None and max_length < min_length):
+            raise ValueError("Token length bounds must satisfy 0 <= min_length <= max_length")
+
+        self.strip_chars = strip_chars or ''
+        self.case_folding = case_folding
+        self.ngram_range = (min_n, max_n)
+        self.stop_words = frozenset(stop_words or ())
+        self.min_length = min_length
+        self.max_length = max_length
+        self._compile()
+
+    def _compile(self):
+        """Pick the cheapest word pipeline for this configuration"""
+        strip_chars = self.strip_chars
+        stop_words = self.stop_words
+        min_length = self.min_length
+        max_length = self.max_length if self.max_length is not None else sys.maxsize
+        normalize = {'casefold': str.casefold, 'lower': str.lower, None: str}[self.case_folding]
+
+        if stop_words or min_length > 1 or max_length < sys.maxsize:
+            def words(text):
+                return [word for raw in normalize(text).split()
+                        if min_length <= len(word := raw.strip(strip_chars)) <= max_length and word not in stop_words]
+        elif min_length == 1:
+            def words(text):
+                return [word for raw in normalize(text).split() if (word := raw.strip(strip_chars))]
+        else:
+            def words(text):
+                return [raw.strip(strip_chars) for raw in normalize(text).split()]
+        self._words = words
+
+    def __call__(self, text):
+        """Return the list of tokens (words followed by any n-grams) for the text"""
+        words = self._words(text)
+        min_n, max_n = self.ngram_range
+        if max_n == 1:
+            return words
+        tokens = list(words) if min_n == 1 else []
+        for n in range(max(min_n, 2), max_n + 1):
+            tokens += [' '.join(words[i:i + n]) for i in range(len(words) - n + 1)]
+        return tokens
+
+    def get_config(self):
+        """JSON-serializable configuration, enough to rebuild an identical tokenizer"""
+        return {
+            'strip_chars': self.strip_chars,
+            'case_folding': self.case_folding,
+            'ngram_range': list(self.ngram_range),
+            'stop_words': sorted(self.stop_words),
+            'min_length': self.min_length,
+            'max_length': self.max_length,
+        }
+
+    @staticmethod
+    def from_config(config):
+        return Tokenizer(**dict(config, ngram_range=tuple(config['ngram_range'])))
+
+    def __eq__(self, other):
+        return isinstance(other, Tokenizer) and self.get_config() == other.get_config()
+
+    def __hash__(self):
+        return hash(repr(self.get_config()))
+
+    def __repr__(self):
+        return f"Tokenizer({', '.join(f'{key}={value!r}' for key, value in self.get_config().items())})"
+
+    # The compiled pipeline is a closure, so pickle (e.g. for worker processes) only the configuration
+    def __getstate__(self):
+        return self.get_config()
+
+    def __setstate__(self, state):
+        self.__init__(**dict(state, ngram_range=tuple(state['ngram_range'])))